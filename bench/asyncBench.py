@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import json
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from lib.apputils import config, dbEngine
+from orm.dbasync import dbAsyncEngine, dbSelectAsync
+from orm.dbfunctions import dbSelect
+from orm.schema import Genre, Track
+
+# Compare dbSelect throughput, sync via run_in_executor against native async, under concurrent callers
+# Run from the repository root: python -m bench.asyncBench --callers 1 8 32
+
+def _lookups(calls:int) -> list:
+    '''
+    Build a repeatable mix of lookups
+    :param calls - Number of lookups
+    :return list - [(model, filters)]
+    :example - _lookups(100)
+    '''
+    return [(Genre, {'Id': i % 25 + 1}) if i % 2 else (Track, {'AlbumId': i % 300 + 1}) for i in range(calls)]
+
+async def benchSync(engine, callers:int, calls:int) -> float:
+    '''
+    Time lookups through the sync API wrapped in run_in_executor
+    :param engine - SQLAlchemy engine instance
+    :param callers - Concurrent callers
+    :param calls - Total lookups
+    :return float - Lookups per second
+    :example - await benchSync(engine, 8, 1000)
+    '''
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        start = time.perf_counter()
+        await asyncio.gather(*[loop.run_in_executor(pool, dbSelect, engine, m, f, False) for m, f in _lookups(calls)])
+        return calls / (time.perf_counter() - start)
+
+async def benchAsync(engine, callers:int, calls:int) -> float:
+    '''
+    Time lookups through the native async API
+    :param engine - SQLAlchemy AsyncEngine instance
+    :param callers - Concurrent callers
+    :param calls - Total lookups
+    :return float - Lookups per second
+    :example - await benchAsync(engine, 8, 1000)
+    '''
+    gate = asyncio.Semaphore(callers)
+    async def call(m, f):
+        async with gate:
+            return await dbSelectAsync(engine, m, f, False)
+    start = time.perf_counter()
+    await asyncio.gather(*[call(m, f) for m, f in _lookups(calls)])
+    return calls / (time.perf_counter() - start)
+
+async def main(args:argparse.Namespace) -> list:
+    '''
+    Run both paths at each concurrency level against a scratch copy of the database
+    :param args - Parsed command line
+    :return list - One result dictionary per concurrency level
+    :example - asyncio.run(main(args))
+    '''
+    appcfg = config(args.ini)
+    work = tempfile.mkdtemp()
+    appcfg[args.section]['dbName'] = shutil.copy(appcfg[args.section]['dbName'], work)
+    engine, aengine = dbEngine(appcfg, args.section), dbAsyncEngine(appcfg, args.section)
+    results = []
+    for callers in args.callers:
+        syncRate = await benchSync(engine, callers, args.calls)
+        asyncRate = await benchAsync(aengine, callers, args.calls)
+        results.append({'callers': callers, 'calls': args.calls, 'sync_per_sec': round(syncRate, 1), 'async_per_sec': round(asyncRate, 1)})
+        print(f'{callers:>4} callers ... sync {syncRate:10.1f}/s  async {asyncRate:10.1f}/s')
+    await aengine.dispose()
+    engine.dispose()
+    shutil.rmtree(work)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sync vs async dbSelect throughput')
+    parser.add_argument('--ini', default='./ini/globals.ini')
+    parser.add_argument('--section', default='DBCFG')
+    parser.add_argument('--callers', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--output', help='Write results as JSON')
+    args = parser.parse_args()
+    results = asyncio.run(main(args))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import sqlalchemy
+from sqlalchemy import create_engine
+from lib.apputils import config
+from orm.dbfunctions import dbDelete, dbSelect, dbSelectAll, dbUpdate
+from orm.dbutils import dbFill, dbInit, dbKill
+from orm.schema import Playlisttrack, Track
+from raw.csvSynth import csvSynth
+
+# Time the core database API against generated data at increasing scales
+# Run from the repository root: python -m bench.benchmark --scales 1 10 100 --output bench.json [--compare base.json]
+# Start up stages are recorded at scale 0
+
+def _timed(results:list, scale:int, stage:str, fn, *args) -> object:
+    '''
+    Run one benchmark stage & record its wall time, stages returning False or an exception are reported & not recorded
+    :param results - List collecting result dictionaries
+    :param scale - Data scale being measured
+    :param stage - Stage name, usually the function under test
+    :param fn - Function to time
+    :param args - Arguments for fn
+    :return object - Whatever fn returned
+    :example - _timed(results, 10, 'dbInit', dbInit, engine)
+    '''
+    start = time.perf_counter()
+    value = fn(*args)
+    seconds = time.perf_counter() - start
+    if value is False or isinstance(value, Exception):
+        print(f'x{scale:<6} {stage:<24} failed, not recorded' + (f' ... {value}' if value is not False else ''))
+        return value
+    rows = len(value) if isinstance(value, list) else value if isinstance(value, int) and not isinstance(value, bool) else None
+    results.append({'scale': scale, 'stage': stage, 'seconds': round(seconds, 6), 'rows': rows})
+    print(f'x{scale:<6} {stage:<24} {seconds:10.4f}s' + (f'  {rows} rows' if rows is not None else ''))
+    return value
+
+def benchScale(workdir:str, scale:int, seed:int, chunkSize:int) -> list:
+    '''
+    Generate data at one scale & time each database stage against it
+    :param workdir - Scratch directory for CSV files & the database
+    :param scale - Multiple of the sam/csv row counts
+    :param seed - Random seed for the generator
+    :param chunkSize - dbFill chunk size, 0 loads each file whole
+    :return list - Result dictionaries for this scale
+    :example - benchScale('/tmp/bench', 10, 42, 10000)
+    '''
+    results = []
+    manifest = csvSynth(os.path.join(workdir, f'x{scale}'), scale, seed, False)
+    dbName = os.path.join(workdir, f'bench_x{scale}.db')
+    if os.path.exists(dbName):
+        dbKill(dbName)
+    engine = create_engine('sqlite:///' + dbName)
+    _timed(results, scale, 'dbInit', dbInit, engine)
+    _timed(results, scale, 'dbFill', dbFill, engine, manifest, dbName, False, chunkSize)
+    _timed(results, scale, 'dbSelectAll', dbSelectAll, engine, Track, False)
+    _timed(results, scale, 'dbSelect', dbSelect, engine, Track, {'GenreId': 1}, False)
+    _timed(results, scale, 'dbUpdate', dbUpdate, engine, Track, {'GenreId': 1}, 'Composer', 'Benchmark', False)
+    _timed(results, scale, 'dbDelete', dbDelete, engine, Playlisttrack, {'PlaylistId': 1}, False)
+    engine.dispose()
+    dbKill(dbName)
+    return results
+
+def benchStartup(workdir:str, runs:int) -> list:
+    '''
+    Time cold starts of the entry point & module imports in fresh interpreters, then dbInit on a current schema
+    :param workdir - Scratch directory for the database
+    :param runs - Interpreter launches per stage, the median is recorded
+    :return list - Result dictionaries at scale 0
+    :example - benchStartup('/tmp/bench', 5)
+    '''
+    results = []
+    # main.py exits with status 0 when it cannot open its log files, so their directory must exist
+    os.makedirs(config('./ini/globals.ini')['LOGCFG']['logloc'], exist_ok=True)
+    stages = (('python main.py', [sys.executable, 'main.py']),
+              ('import orm.dbfunctions', [sys.executable, '-c', 'import orm.dbfunctions']),
+              ('import orm.dbutils', [sys.executable, '-c', 'import orm.dbutils']))
+    for stage, command in stages:
+        times = []
+        for i in range(runs):
+            start = time.perf_counter()
+            run = subprocess.run(command, capture_output=True, text=True)
+            times.append(time.perf_counter() - start)
+            failed = run.returncode or 'Could not' in run.stdout
+            if failed:
+                break
+        if failed:
+            print(f'x{0:<6} {stage:<24} failed, not recorded ... {(run.stdout + run.stderr).strip()[-200:]}')
+            continue
+        seconds = statistics.median(times)
+        results.append({'scale': 0, 'stage': stage, 'seconds': round(seconds, 6), 'rows': None})
+        print(f'x{0:<6} {stage:<24} {seconds:10.4f}s  median of {runs}')
+    dbName = os.path.join(workdir, 'bench_startup.db')
+    if os.path.exists(dbName):
+        dbKill(dbName)
+    engine = create_engine('sqlite:///' + dbName)
+    _timed(results, 0, 'dbInit new', dbInit, engine)
+    _timed(results, 0, 'dbInit current', dbInit, engine)
+    engine.dispose()
+    dbKill(dbName)
+    return results
+
+def benchCompare(results:list, baseline:str) -> None:
+    '''
+    Print the change in each stage's time against an earlier results file
+    :param results - Result dictionaries from this run
+    :param baseline - Fully qualified path to an earlier JSON results file
+    :return None
+    :example - benchCompare(results, './bench/baseline.json')
+    '''
+    with open(baseline, encoding='utf8') as f:
+        base = json.load(f)
+    before = {(r['scale'], r['stage']): r['seconds'] for r in base['results']}
+    print(f'\nCompared with {base["commit"]} ({baseline})')
+    for r in results:
+        old = before.get((r['scale'], r['stage']))
+        if old:
+            print(f'x{r["scale"]:<6} {r["stage"]:<24} {old:10.4f}s -> {r["seconds"]:10.4f}s  {(r["seconds"] - old) / old:+8.1%}')
+
+def _commit() -> str:
+    '''
+    Current git commit, so results can be compared between commits
+    :return str - Short commit hash or 'unknown'
+    :example - _commit()
+    '''
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark dbInit, dbFill & CRUD functions at increasing data scales')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk', type=int, default=10000, help='dbFill chunk size, 0 loads each file whole')
+    parser.add_argument('--workdir', help='Scratch directory, default a temporary one')
+    parser.add_argument('--output', default='./bench/benchmark.json')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    parser.add_argument('--startup', type=int, default=5, help='Cold start runs per stage, 0 to skip')
+    args = parser.parse_args()
+    workdir = args.workdir or tempfile.mkdtemp()
+    os.makedirs(workdir, exist_ok=True)
+    results = benchStartup(workdir, args.startup) if args.startup else []
+    for scale in args.scales:
+        results += benchScale(workdir, scale, args.seed, args.chunk)
+    if not args.workdir:
+        shutil.rmtree(workdir)
+    with open(args.output, 'w', encoding='utf8') as f:
+        json.dump({'commit': _commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                   'sqlalchemy': sqlalchemy.__version__, 'seed': args.seed, 'chunk': args.chunk, 'results': results}, f, indent=2)
+    if args.compare:
+        benchCompare(results, args.compare)
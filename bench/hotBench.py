@@ -0,0 +1,89 @@
+import argparse
+import json
+import shutil
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from lib.apputils import config, dbClose, dbEngine
+from orm.dbfunctions import dbSelect, dbSelectAll
+from orm.schema import Genre, Track
+
+# Compare read latency of the file backed engine against the in-memory hot copy (mode=memory)
+# Run from the repository root: python -m bench.hotBench --calls 2000 --callers 1 8
+
+def _lookups(calls:int) -> list:
+    '''
+    Build a repeatable mix of lookups
+    :param calls - Number of lookups
+    :return list - [(function, args)]
+    :example - _lookups(100)
+    '''
+    mix = []
+    for i in range(calls):
+        if i % 10 == 0:
+            mix.append((dbSelectAll, (Genre, False)))
+        elif i % 2:
+            mix.append((dbSelect, (Track, {'Id': i % 3000 + 1}, False)))
+        else:
+            mix.append((dbSelect, (Track, {'AlbumId': i % 300 + 1}, False)))
+    return mix
+
+def benchLatency(engine, callers:int, calls:int) -> dict:
+    '''
+    Time each lookup individually across concurrent callers
+    :param engine - SQLAlchemy engine instance
+    :param callers - Concurrent callers
+    :param calls - Total lookups
+    :return dict - Mean, p50, p95 & p99 latency in milliseconds & lookups per second
+    :example - benchLatency(engine, 8, 1000)
+    '''
+    def call(lookup):
+        fn, args = lookup
+        start = time.perf_counter()
+        fn(engine, *args)
+        return (time.perf_counter() - start) * 1000
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        start = time.perf_counter()
+        times = sorted(pool.map(call, _lookups(calls)))
+        elapsed = time.perf_counter() - start
+    pct = lambda p: times[min(int(len(times) * p), len(times) - 1)]
+    return {'mean_ms': round(statistics.mean(times), 3), 'p50_ms': round(pct(0.5), 3), 'p95_ms': round(pct(0.95), 3),
+            'p99_ms': round(pct(0.99), 3), 'per_sec': round(calls / elapsed, 1)}
+
+def main(args:argparse.Namespace) -> list:
+    '''
+    Run the lookup mix on both engine modes at each concurrency level against a scratch copy of the database
+    :param args - Parsed command line
+    :return list - One result dictionary per mode & concurrency level
+    :example - main(args)
+    '''
+    appcfg = config(args.ini)
+    work = tempfile.mkdtemp()
+    appcfg[args.section]['dbName'] = shutil.copy(appcfg[args.section]['dbName'], work)
+    results = []
+    for mode in ('file', 'memory'):
+        appcfg[args.section]['mode'] = mode
+        engine = dbEngine(appcfg, args.section)
+        benchLatency(engine, 1, min(args.calls, 200))
+        for callers in args.callers:
+            r = dict(mode=mode, callers=callers, calls=args.calls, **benchLatency(engine, callers, args.calls))
+            results.append(r)
+            print(f'{mode:<7}{callers:>4} callers ... mean {r["mean_ms"]:8.3f}ms  p50 {r["p50_ms"]:8.3f}ms  '
+                  f'p95 {r["p95_ms"]:8.3f}ms  p99 {r["p99_ms"]:8.3f}ms  {r["per_sec"]:10.1f}/s')
+        dbClose(engine)
+    shutil.rmtree(work)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='File backed vs in-memory hot copy read latency')
+    parser.add_argument('--ini', default='./ini/globals.ini')
+    parser.add_argument('--section', default='DBCFG')
+    parser.add_argument('--callers', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--output', help='Write results as JSON')
+    args = parser.parse_args()
+    results = main(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
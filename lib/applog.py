@@ -0,0 +1,90 @@
+import atexit
+import logging, sys, os
+import queue
+import threading
+import time
+import datetime as dt
+from logging.config import fileConfig
+from logging.handlers import QueueHandler, QueueListener
+
+# Background log writers & data trace rate limiting
+_listeners = []
+_trace = {'sample': 5, 'interval': 1.0}
+_traced = {}
+_traceLock = threading.Lock()
+
+def logSetup(logcfg:str, logloc:str, echo:bool, sample:int=5, interval:float=1.0) -> logging.Logger:
+    '''
+    Setup application & database level logging, file writes happen on background listener threads
+    :param logcfg - Fully qualified location of logging config file
+    :param logloc - Directory to store application log files
+    :param echo - Propagate application logs to console
+    :param sample - Rows included when logData traces a dataset
+    :param interval - Minimum seconds between logData traces with the same label
+    :return logger - Updated logger object
+    :example - logger = logSetup('./ini/logger.ini', './logs/', False)
+    '''
+    today = dt.datetime.today()
+    logfile = logloc + f'{today.year}-{today.month:02d}-{today.day:02d}.log'
+    datfile = logloc + f'{today.year}-{today.month:02d}-{today.day:02d}.trc'
+
+    try:
+        os.path.exists(logcfg)
+    except Exception as e:
+        print(f'Could not find {logcfg} file')
+        sys.exit()
+
+    try:
+        logStop()
+        fileConfig(logcfg, defaults={'logfilename':logfile,'datfilename':datfile})
+        for name in ('AppLog', 'DatLog'):
+            logger = logging.getLogger(name)
+            logger.propagate=echo
+            # One queue & listener per logger so records only reach that logger's own handlers
+            records = queue.SimpleQueue()
+            listener = QueueListener(records, *logger.handlers, respect_handler_level=True)
+            logger.handlers = [QueueHandler(records)]
+            listener.start()
+            _listeners.append(listener)
+        _trace.update(sample=sample, interval=interval)
+    except Exception as e:
+        print(f'Could not parse {logcfg} file')
+        sys.exit()
+    return logger
+
+def logStop() -> None:
+    '''
+    Stop the background log writers, flushing any queued records
+    :return None
+    :example - logStop()
+    '''
+    while _listeners:
+        _listeners.pop().stop()
+
+atexit.register(logStop)
+
+def logData(label:str, data:list, count:int=None) -> None:
+    '''
+    Trace a dataset to DatLog as a row count & sample, rate limited per label
+    :param label - Short, stable description of the dataset, eg 'Inserted Tracks'
+    :param data - Rows, or just the sample when count is given
+    :param count - Total rows when data only holds a sample
+    :return None
+    :example - logData(f'Inserted {tblName.__tablename__}', data)
+    '''
+    datlog = logging.getLogger('DatLog')
+    if not datlog.isEnabledFor(logging.INFO):
+        return
+    now = time.monotonic()
+    with _traceLock:
+        last, skipped = _traced.get(label, (-_trace['interval'], 0))
+        if now - last < _trace['interval']:
+            _traced[label] = (last, skipped + 1)
+            return
+        _traced[label] = (now, 0)
+    if not isinstance(data, (list, tuple)):
+        datlog.info('%s ... %s', label, data)
+        return
+    count = len(data) if count is None else count
+    datlog.info('%s ... %d rows, first %d %s%s', label, count, min(count, _trace['sample']), data[0:_trace['sample']],
+                f' ({skipped} similar traces suppressed)' if skipped else '')
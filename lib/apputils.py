@@ -1,7 +1,28 @@
 import configparser
+import hashlib
 import logging, sys, os
-import datetime as dt
-from logging.config import fileConfig
+import sqlalchemy
+import sqlite3
+import threading
+import time
+import weakref
+from lib.applog import logData, logSetup, logStop
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+# SQLite pragmas applied once per pooled connection, in this order, when set in the database section
+PRAGMAS = ('foreign_keys', 'journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store')
+
+# Unbound session factory, engines are bound per call so the factory never keeps one alive
+_sessions = sessionmaker()
+_managed = weakref.WeakSet()
+
+# In-memory hot copies of SQLite files, engine -> (state shared with the flush thread, release finalizer)
+_hot = weakref.WeakKeyDictionary()
+# One copy per database file, name -> state, shared by every engine opened on that file
+_hotCopies = {}
+_hotLock = threading.Lock()
 
 def config(filename:str) -> configparser:
     '''
@@ -19,33 +40,211 @@ def config(filename:str) -> configparser:
         sys.exit()
     return config
 
-def logSetup(logcfg:str, logloc:str, echo:bool) -> logging.Logger:
+def dbEngine(appcfg:configparser, section:str='DBCFG') -> sqlalchemy.engine:
     '''
-    Setup application & database level logging
-    :param logcfg - Fully qualified location of logging config file
-    :param logloc - Directory to store application log files
-    :param echo - Propagate application logs to console
-    :return logger - Updated logger object
-    :example - logger = logSetup('./ini/logger.ini', './logs/', False)
+    Create a pooled database engine with SQLite pragmas applied on connect
+    :param appcfg - ConfigParser object
+    :param section - INI section holding dbType, dbName, pragmas & pool settings
+    :return engine - SQLAlchemy engine instance
+    :example - engine = dbEngine(config('./ini/globals.ini'))
     '''
-    today = dt.datetime.today()
-    logfile = logloc + f'{today.year}-{today.month:02d}-{today.day:02d}.log'
-    datfile = logloc + f'{today.year}-{today.month:02d}-{today.day:02d}.trc'
+    cfg = appcfg[section]
+    url = cfg['dbType'] + cfg['dbName']
+    options = {}
+    hot = None
+    if url.startswith('sqlite') and cfg['dbName'] not in ('', ':memory:') and cfg.get('mode', 'file') == 'memory':
+        hot = _hotLoad(cfg['dbName'], cfg.getfloat('flush_interval', 60))
+        url = f'sqlite:///file:/{hot["name"]}?vfs=memdb&uri=true'
+    if url.startswith('sqlite') and cfg['dbName'] not in ('', ':memory:'):
+        options = {'poolclass': QueuePool,
+                   'pool_size': cfg.getint('pool_size', 5),
+                   'max_overflow': cfg.getint('max_overflow', 10),
+                   'pool_timeout': cfg.getint('pool_timeout', 30),
+                   'connect_args': {'check_same_thread': False}}
+    engine = create_engine(url, **options)
+    dbPragmas(engine, cfg)
+    if hot is not None:
+        _hotStart(engine, hot)
+    return engine
 
-    try:
-        os.path.exists(logcfg)
-    except Exception as e:
-        print(f'Could not find {logcfg} file')
-        sys.exit()
+def _hotLoad(filename:str, interval:float) -> dict:
+    '''
+    Copy a SQLite file into a named in-memory database, or reuse the copy already loaded
+    :param filename - Fully qualified path to the database file
+    :param interval - Seconds between background flushes of committed writes, 0 for explicit & shutdown flushes only
+    :return dict - Hot copy state, its anchor connection keeps the in-memory database alive
+    :example - hot = _hotLoad('./db/monty.db', 60)
+    '''
+    applog = logging.getLogger('AppLog')
+    path = os.path.abspath(filename)
+    name = 'hot_' + hashlib.sha1(path.encode()).hexdigest()[0:12]
+    with _hotLock:
+        hot = _hotCopies.get(name)
+        if hot is not None:
+            # Loading again would overwrite the live copy & its unflushed writes
+            hot['users'] += 1
+            applog.info(f'Reusing {name} for {path}, {hot["users"]} engines')
+            return hot
+        # The memdb VFS uses normal file locking & busy handling, unlike a shared cache which fails with
+        # SQLITE_LOCKED whenever a reader meets a writer on the same table
+        anchor = sqlite3.connect(f'file:/{name}?vfs=memdb', uri=True, check_same_thread=False)
+        started = time.perf_counter()
+        source = sqlite3.connect(path)
+        try:
+            # Unlike the backup API, VACUUM INTO writes a rollback journal header, a WAL file's header would leave
+            # the copy unopenable as memdb has no WAL support
+            source.execute(f"VACUUM INTO 'file:/{name}?vfs=memdb'")
+        finally:
+            source.close()
+        applog.info(f'Loaded {path} into memory as {name} in {time.perf_counter() - started:.3f}s')
+        hot = _hotCopies[name] = {'name': name, 'path': path, 'anchor': anchor, 'interval': interval, 'dirty': False,
+                                  'lock': threading.Lock(), 'stop': threading.Event(), 'thread': None, 'users': 1}
+        return hot
+
+def _hotStart(engine:sqlalchemy.engine, hot:dict) -> None:
+    '''
+    Track commits on a hot copy engine, start its flush thread & flush on close or interpreter exit
+    :param engine - SQLAlchemy engine on the in-memory copy
+    :param hot - State from _hotLoad
+    :return None
+    :example - _hotStart(engine, hot)
+    '''
+    event.listen(engine, 'commit', lambda conn: hot.__setitem__('dirty', True))
+    with _hotLock:
+        if hot['interval'] > 0 and hot['thread'] is None:
+            hot['thread'] = threading.Thread(target=_hotFlusher, args=(hot,), name=f'{hot["name"]}-flush', daemon=True)
+            hot['thread'].start()
+    # The listener, thread & finalizer only reference hot, never the engine, so dropping the last reference to the
+    # engine releases its share of the copy, otherwise this runs at exit, before logStop as it is registered later
+    _hot[engine] = (hot, weakref.finalize(engine, _hotRelease, hot))
+
+def _hotRelease(hot:dict) -> None:
+    '''
+    Drop one engine's use of a hot copy, closing the copy when no engine uses it
+    :param hot - State from _hotLoad
+    :return None
+    :example - weakref.finalize(engine, _hotRelease, hot)
+    '''
+    with _hotLock:
+        hot['users'] -= 1
+        if hot['users'] > 0:
+            return
+        _hotCopies.pop(hot['name'], None)
+    _hotClose(hot)
+
+def _hotFlusher(hot:dict) -> None:
+    '''
+    Flush thread, snapshots committed writes every interval until stopped
+    :param hot - State from _hotLoad
+    :return None
+    :example - threading.Thread(target=_hotFlusher, args=(hot,))
+    '''
+    while not hot['stop'].wait(hot['interval']):
+        try:
+            _hotFlush(hot)
+        except Exception as e:
+            logging.getLogger('AppLog').error(f'Flush of {hot["name"]} to {hot["path"]} failed ... {e}')
+
+def _hotFlush(hot:dict) -> bool:
+    '''
+    Snapshot the in-memory copy back to its file with the backup API, when anything was committed
+    :param hot - State from _hotLoad
+    :return boolean - True when a snapshot was written
+    :example - _hotFlush(hot)
+    '''
+    with hot['lock']:
+        if not hot['dirty']:
+            return False
+        # Cleared first so commits made during the backup are caught by the next flush
+        hot['dirty'] = False
+        started = time.perf_counter()
+        target = sqlite3.connect(hot['path'])
+        try:
+            hot['anchor'].backup(target)
+        except Exception:
+            hot['dirty'] = True
+            raise
+        finally:
+            target.close()
+    logging.getLogger('AppLog').info(f'Flushed {hot["name"]} to {hot["path"]} in {time.perf_counter() - started:.3f}s')
+    return True
 
+def _hotClose(hot:dict) -> None:
+    '''
+    Stop the flush thread, write a final snapshot & release the in-memory copy
+    :param hot - State from _hotLoad
+    :return None
+    :example - _hotClose(hot)
+    '''
+    hot['stop'].set()
+    if hot['thread'] is not None:
+        hot['thread'].join()
     try:
-        fileConfig(logcfg, defaults={'logfilename':logfile,'datfilename':datfile})
-        logger = logging.getLogger('AppLog')
-        logger.propagate=echo
-        logger = logging.getLogger('DatLog')
-        logger.propagate=echo
-    except Exception as e:
-        print(f'Could not parse {logcfg} file')
-        sys.exit()
-    return logger
+        _hotFlush(hot)
+    finally:
+        hot['anchor'].close()
 
+def dbFlush(engine:sqlalchemy.engine) -> bool:
+    '''
+    Snapshot a hot copy engine's committed writes to its database file now
+    :param engine - SQLAlchemy engine instance
+    :return boolean - True when a snapshot was written, False when nothing changed or the engine is file backed
+    :example - dbFlush(engine)
+    '''
+    entry = _hot.get(engine)
+    return _hotFlush(entry[0]) if entry is not None else False
+
+def dbClose(engine:sqlalchemy.engine) -> None:
+    '''
+    Dispose of an engine, flushing its in-memory copy & releasing it once no other engine uses it
+    :param engine - SQLAlchemy engine instance
+    :return None
+    :example - dbClose(engine)
+    '''
+    engine.dispose()
+    entry = _hot.pop(engine, None)
+    if entry is not None:
+        hot, release = entry
+        _hotFlush(hot)
+        release()
+
+def dbPragmas(engine:sqlalchemy.engine, cfg:configparser.SectionProxy) -> bool:
+    '''
+    Apply the configured SQLite pragmas to every new pooled connection
+    :param engine - SQLAlchemy engine instance, the sync_engine of an AsyncEngine
+    :param cfg - INI section holding the pragma settings
+    :return boolean - True when foreign keys are enforced per connection
+    :example - dbPragmas(engine, appcfg['DBCFG'])
+    '''
+    pragmas = [(p, cfg[p]) for p in PRAGMAS if p in cfg]
+    if engine.name != 'sqlite' or not pragmas:
+        return False
+    @event.listens_for(engine, 'connect')
+    def _pragmas(dbapi_conn, record):
+        cursor = dbapi_conn.cursor()
+        for pragma, value in pragmas:
+            cursor.execute(f'pragma {pragma}={value}')
+        cursor.close()
+    if dict(pragmas).get('foreign_keys', '').lower() in ('on', '1', 'true', 'yes'):
+        _managed.add(engine)
+        return True
+    return False
+
+def dbSession(engine:sqlalchemy.engine, **options) -> Session:
+    '''
+    Open a session from the engine's reusable session factory
+    :param engine - SQLAlchemy engine instance
+    :param options - Session overrides, eg expire_on_commit=False
+    :return session - New SQLAlchemy Session
+    :example - with dbSession(engine) as session: ...
+    '''
+    return _sessions(bind=engine, **options)
+
+def dbManaged(engine:sqlalchemy.engine) -> bool:
+    '''
+    Check whether foreign key enforcement is already applied per connection by dbEngine
+    :param engine - SQLAlchemy engine instance
+    :return boolean - True or False
+    :example - dbManaged(engine)
+    '''
+    return engine in _managed
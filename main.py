@@ -1,7 +1,16 @@
-from sqlalchemy import create_engine
-from lib.apputils import config, logSetup
+import atexit
+from lib.apputils import config, dbEngine, logSetup
+from orm.dbcache import cacheSetup
 
 if __name__ == '__main__':
     appcfg = config('./ini/globals.ini')
-    logger = logSetup(appcfg['LOGCFG']['logcfg'], appcfg['LOGCFG']['logloc'], eval(appcfg['LOGCFG']['logecho']))
-    engine = create_engine(appcfg['DBCFG']['dbType'] + appcfg['DBCFG']['dbName'])
+    logger = logSetup(appcfg['LOGCFG']['logcfg'], appcfg['LOGCFG']['logloc'], eval(appcfg['LOGCFG']['logecho']), appcfg['LOGCFG'].getint('logsample'), appcfg['LOGCFG'].getfloat('loginterval'))
+    engine = dbEngine(appcfg)
+    cacheSetup(appcfg['DBCACHE'].getint('size'), appcfg['DBCACHE'].getfloat('ttl'))
+    # Optional modules are imported only when configured, keeping start up to what is used
+    if appcfg['DBTRACE'].getboolean('enabled'):
+        from orm.dbtrace import traceAttach
+        traceAttach(engine, appcfg['DBTRACE'].getfloat('slowms'), appcfg['DBTRACE'].getint('topn'))
+    if appcfg['DBFILTER'].getboolean('advise'):
+        from orm.dbfilter import filterAdvise
+        atexit.register(filterAdvise, engine, appcfg['DBFILTER'].getint('mincalls'), appcfg['DBFILTER'].getboolean('create'))
@@ -0,0 +1,242 @@
+import glob
+import logging
+import os
+import sqlalchemy
+import weakref
+from datetime import datetime
+from sqlalchemy import Column, MetaData, Table, create_engine, delete, event, func, insert, select
+from orm.dbcache import cacheInvalidate
+from orm.schema import *
+from orm.summary import SUMMARIES, dbSummaryKeys, dbSummaryRefresh
+
+# Invoice archival into per-period SQLite files, attached to every connection of an engine for querying
+
+ARCHIVED = (Invoice, Invoiceitem)
+PREFIX = 'invoices_'
+# SQLite attaches at most 10 databases per connection, one is kept free for dbArchive,
+# older periods are merged into one invoices_<first>_to_<last>.db file to stay within it
+LIMIT = 9
+
+_attached = weakref.WeakKeyDictionary()
+
+def _arcColumns(table:Table) -> list:
+    '''
+    Copy a table's columns without foreign keys, which SQLite cannot resolve across attached files
+    :param table - Source Table
+    :return list - New Column objects
+    :example - _arcColumns(Invoice.__table__)
+    '''
+    return [Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable, index=c.index) for c in table.columns]
+
+# Read only views over the hot tables & every attached archive, created per connection by dbArchiveAttach
+_views = MetaData()
+
+class Invoicehistory(Base):
+    '''
+    Invoices, hot & archived
+    '''
+    __tablename__ = 'InvoicesHistory'
+    __table__ = Table(__tablename__, _views, *_arcColumns(Invoice.__table__))
+
+class Invoiceitemhistory(Base):
+    '''
+    Invoice line items, hot & archived
+    '''
+    __tablename__ = 'InvoiceItemsHistory'
+    __table__ = Table(__tablename__, _views, *_arcColumns(Invoiceitem.__table__))
+
+HISTORY = {Invoice: Invoicehistory, Invoiceitem: Invoiceitemhistory}
+
+def _arcDate():
+    '''
+    InvoiceDate, held as dd/mm/yyyy hh:mm, as a sortable yyyy-mm-dd string
+    :return ColumnElement
+    :example - select(Invoice.Id).where(_arcDate() < '2010-01-01')
+    '''
+    d = Invoice.InvoiceDate
+    return func.substr(d, 7, 4).concat('-').concat(func.substr(d, 4, 2)).concat('-').concat(func.substr(d, 1, 2))
+
+def _arcSchema(period:str) -> str:
+    '''
+    Attached schema name of an archive period
+    :param period - yyyy, yyyy-mm or a merged range such as 2009_to_2011-03
+    :return str - eg arch_2009, arch_2009_01 or arch_2009_to_2011_03
+    :example - _arcSchema('2009-01')
+    '''
+    return 'arch_' + period.replace('-', '_')
+
+def dbArchiveFiles(archdir:str) -> dict:
+    '''
+    Archive files in a directory
+    :param archdir - Directory holding the archive files
+    :return dict - {'SchemaName':'FilePath'} in period order
+    :example - dbArchiveFiles('./db/archive/')
+    '''
+    files = sorted(glob.glob(os.path.join(archdir, PREFIX + '*.db')))
+    return {_arcSchema(os.path.basename(f)[len(PREFIX):-3]): os.path.abspath(f) for f in files}
+
+def dbArchiveCompact(archdir:str, limit:int=LIMIT) -> list:
+    '''
+    Merge the oldest archive files into one so no more than limit files remain, all of them attachable
+    :param archdir - Directory holding the archive files
+    :param limit - Archive files to keep at most
+    :return list - Files merged & removed, empty when there were few enough
+    :example - dbArchiveCompact('./db/archive/')
+    '''
+    files = list(dbArchiveFiles(archdir).values())
+    if len(files) <= limit:
+        return []
+    merge = files[0:len(files) - limit + 1]
+    periods = [os.path.basename(f)[len(PREFIX):-3] for f in merge]
+    target = os.path.join(os.path.dirname(merge[0]), f'{PREFIX}{periods[0].split("_to_")[0]}_to_{periods[-1].split("_to_")[-1]}.db')
+    meta = MetaData()
+    for m in ARCHIVED:
+        Table(m.__tablename__, meta, *_arcColumns(m.__table__))
+    engine = create_engine('sqlite:///' + target)
+    try:
+        with engine.connect() as conn:
+            with conn.begin():
+                meta.create_all(conn)
+            for filename in merge:
+                conn.exec_driver_sql('ATTACH DATABASE ? AS arch_src', (filename,))
+                try:
+                    # Copied & committed before any file is removed, OR REPLACE makes rerunning after a crash safe
+                    with conn.begin():
+                        for m in ARCHIVED:
+                            cols = ', '.join(f'"{c.name}"' for c in m.__table__.columns)
+                            conn.exec_driver_sql(f'INSERT OR REPLACE INTO main."{m.__tablename__}" ({cols}) '
+                                                 f'SELECT {cols} FROM arch_src."{m.__tablename__}"')
+                    for m in ARCHIVED:
+                        missing = conn.exec_driver_sql(f'SELECT count(*) FROM arch_src."{m.__tablename__}" WHERE "Id" NOT IN '
+                                                       f'(SELECT "Id" FROM main."{m.__tablename__}")').scalar()
+                        if missing:
+                            raise RuntimeError(f'{target} is missing {missing} {m.__tablename__} rows of {filename}, nothing removed')
+                finally:
+                    conn.exec_driver_sql('DETACH DATABASE arch_src')
+    finally:
+        engine.dispose()
+    for filename in merge:
+        os.remove(filename)
+    logging.getLogger('AppLog').info(f'Merged {len(merge)} archive files into {target}')
+    return merge
+
+def _arcViews(cursor, schemas:list) -> None:
+    '''
+    Create the temporary history views of one connection over main & its attached archives
+    :param cursor - DBAPI cursor
+    :param schemas - Attached archive schema names
+    :return None
+    :example - _arcViews(cursor, ['arch_2009'])
+    '''
+    for model, history in HISTORY.items():
+        name = model.__tablename__
+        cols = ', '.join(f'"{c.name}"' for c in model.__table__.columns)
+        parts = [f'SELECT {cols} FROM main."{name}"'] + [f'SELECT {cols} FROM "{s}"."{name}"' for s in schemas]
+        cursor.execute(f'DROP VIEW IF EXISTS temp."{history.__tablename__}"')
+        cursor.execute(f'CREATE TEMP VIEW "{history.__tablename__}" AS ' + ' UNION ALL '.join(parts))
+
+def dbArchiveAttach(engine:sqlalchemy.engine, archdir:str) -> list:
+    '''
+    Attach every archive file to each new connection of an engine & create the history views over them
+    :param engine - SQLAlchemy engine instance on a SQLite database
+    :param archdir - Directory holding the archive files, compacted first when it holds more than LIMIT
+    :return list - Schema names of the archive files, connections already pooled are replaced
+    :example - dbArchiveAttach(engine, './db/archive/'); dbSelect(engine, Invoicehistory, {'CustomerId':1}, False)
+    '''
+    dbArchiveCompact(archdir)
+    if engine not in _attached:
+        def _attach(dbapi_conn, record):
+            archives = dbArchiveFiles(_attached[engine])
+            if len(archives) > LIMIT:
+                # Only when files were added behind dbArchive's back since the last compaction
+                logging.getLogger('AppLog').error(f'{len(archives)} archive files, only the latest {LIMIT} are attached, '
+                                                  f'call dbArchiveAttach again to merge the older ones')
+                archives = dict(list(archives.items())[-LIMIT:])
+            cursor = dbapi_conn.cursor()
+            for schema, filename in archives.items():
+                cursor.execute('ATTACH DATABASE ? AS ' + schema, (filename,))
+            _arcViews(cursor, list(archives))
+            cursor.close()
+        event.listen(engine, 'connect', _attach)
+    _attached[engine] = archdir
+    engine.dispose()
+    return list(dbArchiveFiles(archdir))
+
+def dbArchive(engine:sqlalchemy.engine, before:str, archdir:str, verbose:bool, period:str='year', chunkSize:int=1000) -> dict:
+    '''
+    Move invoices dated before a day, with their line items, into per-period archive files
+    Sales summaries are refreshed as invoices move, so they cover the live tables as dbSummaryRebuild does
+    :param engine - SQLAlchemy engine instance on a SQLite database
+    :param before - Archive invoices dated before this day, yyyy-mm-dd
+    :param archdir - Directory for the invoices_<period>.db archive files
+    :param verbose - Enable verbose mode
+    :param period - year or month, the oldest files are merged once there are more than LIMIT
+    :param chunkSize - Invoices moved per transaction
+    :return dict - {'invoices':int, 'items':int, 'files':[...], 'merged':[...]} or exception
+    :example - dbArchive(engine, '2011-01-01', './db/archive/', False)
+    '''
+    applog = logging.getLogger('AppLog')
+    counts = {'invoices': 0, 'items': 0, 'files': [], 'merged': []}
+    try:
+        datetime.strptime(before, '%Y-%m-%d')
+        os.makedirs(archdir, exist_ok=True)
+        width = 4 if period == 'year' else 7
+        key = func.substr(_arcDate(), 1, width)
+        old = _arcDate() < before
+        with engine.connect() as conn:
+            periods = conn.execute(select(key).where(old).distinct().order_by(key)).scalars().all()
+            for p in periods:
+                filename = os.path.abspath(os.path.join(archdir, f'{PREFIX}{p}.db'))
+                schema = 'arch_move'
+                # ATTACH cannot run inside a transaction
+                conn.exec_driver_sql('ATTACH DATABASE ? AS ' + schema, (filename,))
+                try:
+                    meta = MetaData(schema=schema)
+                    tables = {m: Table(m.__tablename__, meta, *_arcColumns(m.__table__)) for m in ARCHIVED}
+                    with conn.begin():
+                        meta.create_all(conn)
+                    items = Invoiceitem.__table__
+                    last = 0
+                    while True:
+                        # In WAL mode a transaction over attached files is not atomic as a set, so rows are
+                        # copied & committed first, then verified & deleted, a crash leaves copies, never losses
+                        with conn.begin():
+                            ids = conn.execute(select(Invoice.Id).where(old, key == p, Invoice.Id > last)
+                                               .order_by(Invoice.Id).limit(chunkSize)).scalars().all()
+                            if not ids:
+                                break
+                            last = ids[-1]
+                            # OR REPLACE makes rerunning after a crash between the two steps safe
+                            conn.execute(insert(tables[Invoice]).prefix_with('OR REPLACE').from_select(
+                                         Invoice.__table__.c.keys(), select(Invoice.__table__).where(Invoice.Id.in_(ids))))
+                            conn.execute(insert(tables[Invoiceitem]).prefix_with('OR REPLACE').from_select(
+                                         items.c.keys(), select(items).where(items.c.InvoiceId.in_(ids))))
+                        with conn.begin():
+                            copied = [conn.execute(select(func.count()).select_from(t).where(col.in_(ids))).scalar()
+                                      for t, col in ((tables[Invoice], tables[Invoice].c.Id),
+                                                     (tables[Invoiceitem], tables[Invoiceitem].c.InvoiceId),
+                                                     (items, items.c.InvoiceId))]
+                            if copied[0] != len(ids) or copied[1] != copied[2]:
+                                raise RuntimeError(f'{filename} holds {copied[0]} of {len(ids)} invoices & '
+                                                   f'{copied[1]} of {copied[2]} items, nothing deleted')
+                            keys = dbSummaryKeys(conn, set(ids))
+                            moved = conn.execute(delete(items).where(items.c.InvoiceId.in_(ids))).rowcount
+                            conn.execute(delete(Invoice.__table__).where(Invoice.Id.in_(ids)))
+                            dbSummaryRefresh(conn, keys)
+                        counts['invoices'] += len(ids)
+                        counts['items'] += moved
+                        applog.info(f'Archived {counts["invoices"]} invoices & {counts["items"]} items ... {filename}')
+                finally:
+                    conn.exec_driver_sql(f'DETACH DATABASE {schema}')
+                counts['files'].append(filename)
+        counts['merged'] = dbArchiveCompact(archdir)
+        for model in ARCHIVED + SUMMARIES:
+            cacheInvalidate(engine, model)
+        if engine in _attached:
+            dbArchiveAttach(engine, _attached[engine])
+        if verbose:
+            logging.getLogger('DatLog').info(f'Archived invoices before {before} ... {counts}')
+        return counts
+    except Exception as e:
+        applog.error(e)
+        return e
@@ -0,0 +1,251 @@
+import configparser
+import logging
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from lib.apputils import dbManaged, dbPragmas, logData
+from orm.dbcache import cacheInvalidate
+from orm.dbfilter import filterStatement
+from orm.summary import dbSummaryAfter, dbSummaryBefore, dbSummaryIds, dbSummaryRebuild, dbSummaryRegroups
+from orm.schema import *
+
+# Async counterparts of orm.dbfunctions, same arguments & return values
+
+# Unbound session factory, engines are bound per call so the factory never keeps one alive
+_sessions = sessionmaker(class_=AsyncSession, expire_on_commit=False)
+
+def dbAsyncEngine(appcfg:configparser, section:str='DBCFG') -> AsyncEngine:
+    '''
+    Create an asyncio engine, SQLite databases use the aiosqlite driver
+    :param appcfg - ConfigParser object
+    :param section - INI section holding dbType, dbName, pragma & pool settings
+    :return engine - SQLAlchemy AsyncEngine instance
+    :example - engine = dbAsyncEngine(config('./ini/globals.ini'))
+    '''
+    cfg = appcfg[section]
+    url = cfg['dbType'] + cfg['dbName']
+    options = {}
+    if url.startswith('sqlite:'):
+        url = 'sqlite+aiosqlite:' + url[len('sqlite:'):]
+        if cfg['dbName'] not in ('', ':memory:'):
+            options = {'poolclass': AsyncAdaptedQueuePool,
+                       'pool_size': cfg.getint('pool_size', 5),
+                       'max_overflow': cfg.getint('max_overflow', 10),
+                       'pool_timeout': cfg.getint('pool_timeout', 30)}
+    engine = create_async_engine(url, **options)
+    dbPragmas(engine.sync_engine, cfg)
+    return engine
+
+def _dbSession(engine:AsyncEngine) -> AsyncSession:
+    '''
+    Open a session from the engine's reusable async session factory
+    :param engine - SQLAlchemy AsyncEngine instance
+    :return session - New AsyncSession, attributes stay loaded after commit
+    :example - async with _dbSession(engine) as session: ...
+    '''
+    return _sessions(bind=engine)
+
+async def _dbForeignKeys(engine:AsyncEngine, session:AsyncSession) -> None:
+    '''
+    Enforce foreign keys for engines not built with per-connection pragmas
+    :param engine - SQLAlchemy AsyncEngine instance
+    :param session - AsyncSession about to write
+    :return None
+    :example - await _dbForeignKeys(engine, session)
+    '''
+    if engine.name == 'sqlite' and not dbManaged(engine.sync_engine):
+        await session.execute('pragma foreign_keys=on')
+
+def _dbRow(row:Base) -> dict:
+    '''
+    Flatten a model instance the way orm.dbfunctions selects do
+    :param row - SQLAlchemy data object
+    :return dict - {'ColumnName':'Value'}
+    :example - _dbRow(genre)
+    '''
+    return {col: str(getattr(row, col)) for col in row.__table__.c.keys()}
+
+# Table level functions
+async def dbInsertAllAsync(engine:AsyncEngine, tblName:Base, data:list, verbose:bool) -> int:
+    '''
+    Insert multiple records into database table
+    :param engine - SQLAlchemy AsyncEngine instance
+    :param tblName - Database tablename
+    :param data - List of mappings
+    :param verbose - Enable verbose mode
+    :return int - Number of records inserted or exception
+    :example - await dbInsertAllAsync(engine, Genre, [{'GenreName':'Screaming'}], False)
+    '''
+    applog = logging.getLogger('AppLog')
+    async with _dbSession(engine) as session:
+        await _dbForeignKeys(engine, session)
+        try:
+            await session.run_sync(lambda s: s.bulk_insert_mappings(tblName, data))
+            if tblName is Invoiceitem:
+                await session.run_sync(lambda s: dbSummaryAfter(engine, s, None, dbSummaryIds(data)))
+            await session.commit()
+            cacheInvalidate(engine, tblName)
+            if verbose:
+                logData(f'Inserted {tblName.__tablename__}', data)
+            return len(data)
+        except Exception as e:
+            await session.rollback()
+            applog.error(e)
+            return e
+
+async def dbSelectAllAsync(engine:AsyncEngine, tblName:Base, verbose:bool) -> list:
+    '''
+    Select all records from a database table
+    :param engine - SQLAlchemy AsyncEngine instance
+    :param tblName - Database tablename
+    :param verbose - Enable verbose mode
+    :return data - Query results as list
+    :example - x = await dbSelectAllAsync(engine, Genre, True)
+    '''
+    async with _dbSession(engine) as session:
+        results = await session.execute(select(tblName))
+        data = [_dbRow(row) for row in results.scalars()]
+        if verbose:
+            logData(f'Selected {tblName.__tablename__}', data)
+        return data
+
+async def dbUpdateAllAsync(engine:AsyncEngine, tblName:Base, updAttr:str, updVal:str, verbose:bool) -> int:
+    '''
+    Update unfiltered records in a database table
+    :param engine - SQLAlchemy AsyncEngine instance
+    :param tblName - Database tablename
+    :param updAttr - Table column to update
+    :param updVal - New value for table column
+    :param verbose - Enable verbose mode
+    :return results - Integer of update results processed
+    :example - x = await dbUpdateAllAsync(engine, Customer, 'City', 'My Town', True)
+    '''
+    return await dbUpdateAsync(engine, tblName, {}, updAttr, updVal, verbose)
+
+async def dbDeleteAllAsync(engine:AsyncEngine, tblName:Base, verbose:bool) -> int:
+    '''
+    Delete all records from table
+    :param engine - SQLAlchemy AsyncEngine instance
+    :param tblName - Database tablename
+    :param verbose - Enable verbose mode
+    :return int - Number of records deleted
+    :example - await dbDeleteAllAsync(engine, Customer, True)
+    '''
+    return await dbDeleteAsync(engine, tblName, {}, verbose)
+
+# Record level functions
+async def dbInsertAsync(engine:AsyncEngine, data:Base, verbose:bool) -> int:
+    '''
+    Insert record into database table
+    :param engine - SQLAlchemy AsyncEngine instance
+    :param data - SQLALchemy data object
+    :param verbose - Enable verbose mode
+    :return int - RowId of inserted record
+    :example - await dbInsertAsync(engine, Genre(GenreName='Screaming'), True)
+    '''
+    applog = logging.getLogger('AppLog')
+    datlog = logging.getLogger('DatLog')
+    async with _dbSession(engine) as session:
+        await _dbForeignKeys(engine, session)
+        try:
+            session.add(data)
+            if isinstance(data, (Invoice, Invoiceitem)):
+                await session.flush()
+                await session.run_sync(lambda s: dbSummaryAfter(engine, s, None, dbSummaryIds([data])))
+            await session.commit()
+            cacheInvalidate(engine, type(data))
+            if verbose:
+                datlog.info(f'Added record number {data.Id} to {data.__tablename__}')
+            return data.Id
+        except Exception as e:
+            await session.rollback()
+            applog.error(e)
+
+async def dbSelectAsync(engine:AsyncEngine, tblName:Base, filters:dict, verbose:bool) -> list:
+    '''
+    Select records from a database table
+    :param engine - SQLAlchemy AsyncEngine instance
+    :param tblName - Database tablename
+    :param filters - Dictionary {'ColumnName':'Criteria'}
+    :param verbose - Enable verbose mode
+    :return data - Query results as list, None when nothing matches
+    :example - x = await dbSelectAsync(engine, Customer, {'Country':'Brazil'}, True)
+    '''
+    datlog = logging.getLogger('DatLog')
+    async with _dbSession(engine) as session:
+        stmt, params = filterStatement(tblName, filters)
+        results = await session.execute(stmt, params)
+        data = [_dbRow(row) for row in results.scalars()]
+        if len(data) > 0:
+            if verbose:
+                logData(f'Selected {tblName.__tablename__}', data)
+            return data
+        else:
+            datlog.info('Missing ... %s', filters)
+
+async def dbUpdateAsync(engine:AsyncEngine, tblName:Base, filters:dict, updAttr:str, updVal:str, verbose:bool) -> int:
+    '''
+    Update filtered records in a database table
+    :param engine - SQLAlchemy AsyncEngine instance
+    :param tblName - Database tablename
+    :param filters - Dictionary {'ColumnName':'Criteria' [,...]}
+    :param updAttr - Table column to update
+    :param updVal - New value for table column
+    :param verbose - Enable verbose mode
+    :return results - Integer of update results processed
+    :example - x = await dbUpdateAsync(engine, Customer, {'Country':'Brazil'}, 'City', 'My Town', True)
+    '''
+    applog = logging.getLogger('AppLog')
+    datlog = logging.getLogger('DatLog')
+    async with _dbSession(engine) as session:
+        try:
+            touched = await session.run_sync(dbSummaryBefore, tblName, filters) if filters else None
+            stmt, params = filterStatement(tblName, filters, 'update', updAttr)
+            results = await session.execute(stmt, dict(params, _value=updVal))
+            if touched is not None:
+                extra = {updVal} if tblName is Invoiceitem and updAttr == 'InvoiceId' else ()
+                await session.run_sync(lambda s: dbSummaryAfter(engine, s, touched, extra))
+            elif dbSummaryRegroups(tblName, updAttr):
+                await session.run_sync(lambda s: dbSummaryRebuild(s, engine))
+            await session.commit()
+            cacheInvalidate(engine, tblName)
+            if verbose:
+                datlog.info(f'Updated {tblName.__tablename__} table, {updAttr} column contents, to "{updVal}" {results.rowcount} times')
+            return results.rowcount
+        except Exception as e:
+            await session.rollback()
+            applog.error(e)
+            return e
+
+async def dbDeleteAsync(engine:AsyncEngine, tblName:Base, filters:dict, verbose:bool) -> int:
+    '''
+    Delete records from a database table
+    :param engine - SQLAlchemy AsyncEngine instance
+    :param tblName - Database tablename
+    :param filters - Dictionary {'ColumnName':'Criteria'}
+    :param verbose - Enable verbose mode
+    :return int - Number of records deleted
+    :example - await dbDeleteAsync(engine, Customer, {'Country':'Brazil'}, True)
+    '''
+    applog = logging.getLogger('AppLog')
+    datlog = logging.getLogger('DatLog')
+    async with _dbSession(engine) as session:
+        await _dbForeignKeys(engine, session)
+        try:
+            touched = await session.run_sync(dbSummaryBefore, tblName, filters) if filters else None
+            stmt, params = filterStatement(tblName, filters, 'delete')
+            results = await session.execute(stmt, params)
+            if touched is not None:
+                await session.run_sync(lambda s: dbSummaryAfter(engine, s, touched))
+            elif tblName in (Invoice, Invoiceitem):
+                await session.run_sync(lambda s: dbSummaryRebuild(s, engine))
+            await session.commit()
+            cacheInvalidate(engine, tblName)
+            if verbose:
+                datlog.info(f'Deleted {filters} from {tblName.__tablename__} table {results.rowcount} times')
+            return results.rowcount
+        except Exception as e:
+            await session.rollback()
+            applog.error(e)
+            return e
@@ -0,0 +1,142 @@
+import sqlalchemy
+import threading
+import time
+from collections import OrderedDict
+from orm.schema import Base
+
+# Read-through cache for dbSelect, keyed by (database, table, frozen filters)
+_cache = OrderedDict()
+# Per (database, table) write generation, bumped by every invalidation
+_generations = {}
+_lock = threading.Lock()
+_settings = {'size': 256, 'ttl': 300.0}
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+def cacheSetup(size:int, ttl:float) -> None:
+    '''
+    Configure the select cache and empty it
+    :param size - Maximum entries held, least recently used are evicted first
+    :param ttl - Seconds an entry stays valid, 0 for no expiry
+    :return None
+    :example - cacheSetup(256, 300)
+    '''
+    with _lock:
+        _settings['size'] = size
+        _settings['ttl'] = ttl
+        _cache.clear()
+
+def _cacheFreeze(value) -> object:
+    '''
+    Make filter values hashable
+    :param value - Filter dictionary or value
+    :return object - Hashable equivalent
+    :example - _cacheFreeze({'Id':[1, 2]})
+    '''
+    if isinstance(value, dict):
+        return frozenset((k, _cacheFreeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_cacheFreeze(v) for v in value)
+    return value
+
+def _cacheDb(engine:sqlalchemy.engine) -> str:
+    '''
+    Identify the database behind an engine, ignoring the driver so sync & async engines share entries
+    :param engine - SQLAlchemy engine or AsyncEngine instance
+    :return str - Backend name & database
+    :example - _cacheDb(engine)
+    '''
+    return f'{engine.url.get_backend_name()}:{engine.url.database}'
+
+def _cacheKey(engine:sqlalchemy.engine, tblName:Base, filters:dict) -> tuple:
+    '''
+    Build the cache key for a select
+    :param engine - SQLAlchemy engine instance
+    :param tblName - Database tablename
+    :param filters - Dictionary {'ColumnName':'Criteria'}
+    :return tuple - (database, tablename, frozen filters)
+    :example - _cacheKey(engine, Genre, {'GenreName':'Rock'})
+    '''
+    return (_cacheDb(engine), tblName.__tablename__, _cacheFreeze(filters or {}))
+
+def cacheGet(engine:sqlalchemy.engine, tblName:Base, filters:dict) -> tuple:
+    '''
+    Look up cached select results
+    :param engine - SQLAlchemy engine instance
+    :param tblName - Database tablename
+    :param filters - Dictionary {'ColumnName':'Criteria'}
+    :return tuple - (True, data) on a hit, (False, None) on a miss
+    :example - hit, data = cacheGet(engine, Genre, {'GenreName':'Rock'})
+    '''
+    key = _cacheKey(engine, tblName, filters)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and _settings['ttl'] and time.monotonic() - entry[0] > _settings['ttl']:
+            del _cache[key]
+            _stats['expirations'] += 1
+            entry = None
+        if entry is None:
+            _stats['misses'] += 1
+            return False, None
+        _cache.move_to_end(key)
+        _stats['hits'] += 1
+        return True, entry[1]
+
+def cacheGeneration(engine:sqlalchemy.engine, tblName:Base) -> int:
+    '''
+    Current write generation of a table, read before running a select that will be cached
+    :param engine - SQLAlchemy engine instance
+    :param tblName - Database tablename
+    :return int - Generation, changes whenever the table's entries are invalidated
+    :example - generation = cacheGeneration(engine, Genre)
+    '''
+    with _lock:
+        return _generations.get((_cacheDb(engine), tblName.__tablename__), 0)
+
+def cachePut(engine:sqlalchemy.engine, tblName:Base, filters:dict, data:object, generation:int=None) -> None:
+    '''
+    Store select results, evicting the least recently used entries over the size limit
+    :param engine - SQLAlchemy engine instance
+    :param tblName - Database tablename
+    :param filters - Dictionary {'ColumnName':'Criteria'}
+    :param data - Select results
+    :param generation - cacheGeneration from before the select, results are discarded if the table was written since
+    :return None
+    :example - cachePut(engine, Genre, {'GenreName':'Rock'}, data, generation)
+    '''
+    if _settings['size'] <= 0:
+        return
+    key = _cacheKey(engine, tblName, filters)
+    with _lock:
+        if generation is not None and _generations.get(key[0:2], 0) != generation:
+            return
+        _cache[key] = (time.monotonic(), data)
+        _cache.move_to_end(key)
+        while len(_cache) > _settings['size']:
+            _cache.popitem(last=False)
+            _stats['evictions'] += 1
+
+def cacheInvalidate(engine:sqlalchemy.engine, tblName:Base) -> int:
+    '''
+    Drop every cached entry for a table
+    :param engine - SQLAlchemy engine instance
+    :param tblName - Database tablename
+    :return int - Number of entries dropped
+    :example - cacheInvalidate(engine, Genre)
+    '''
+    db, table = _cacheDb(engine), tblName.__tablename__
+    with _lock:
+        _generations[(db, table)] = _generations.get((db, table), 0) + 1
+        keys = [k for k in _cache if k[0] == db and k[1] == table]
+        for k in keys:
+            del _cache[k]
+        _stats['invalidations'] += len(keys)
+        return len(keys)
+
+def cacheStats() -> dict:
+    '''
+    Report cache counters
+    :return dict - Hits, misses, evictions, expirations, invalidations & current size
+    :example - cacheStats()['hits']
+    '''
+    with _lock:
+        return dict(_stats, size=len(_cache))
@@ -0,0 +1,109 @@
+from decimal import Decimal
+from functools import lru_cache
+from operator import itemgetter
+from orm.schema import *
+
+# Compiled converters, keyed by (dialect name, model, CSV fields)
+_converters = {}
+
+@lru_cache(maxsize=None)
+def _numpy() -> object:
+    '''
+    NumPy, imported on first use rather than at start up as it dominates import time
+    :return module - numpy, or None when it is not installed
+    :example - np = _numpy()
+    '''
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+def _dbCast(col, dialect) -> callable:
+    '''
+    Build the str to DBAPI value cast for one column
+    :param col - SQLAlchemy Column
+    :param dialect - SQLAlchemy dialect instance
+    :return callable - Converts one raw CSV value
+    :example - cast = _dbCast(Track.__table__.c.UnitPrice, engine.dialect)
+    '''
+    pytype = col.type.python_type
+    if pytype is str:
+        return None
+    if pytype is Decimal and not dialect.supports_native_decimal:
+        cast = float
+    else:
+        bind = col.type.bind_processor(dialect)
+        cast = pytype if bind is None else lambda v: bind(pytype(v))
+    return lambda v: cast(v) if v != '' and v is not None else None
+
+def dbConverter(dialect, tblName:Base, fields:tuple) -> tuple:
+    '''
+    Compile a row converter for a model from its __table__ columns
+    :param dialect - SQLAlchemy dialect instance, eg engine.dialect
+    :param tblName - Database tablename
+    :param fields - CSV header, in file order
+    :return tuple - (columns, casts, defaults) ready for dbConvert
+    :example - columns, casts, defaults = dbConverter(engine.dialect, Track, ('TrackName','AlbumId'))
+    '''
+    key = (dialect.name, tblName, tuple(fields))
+    if key not in _converters:
+        table = tblName.__table__
+        used = [f for f in fields if f in table.c]
+        casts = tuple(_dbCast(table.c[f], dialect) for f in used)
+        defaults = tuple(c for c in table.c if c.name not in used and c.default is not None and not c.primary_key)
+        _converters[key] = (tuple(used) + tuple(c.name for c in defaults), casts, defaults)
+    return _converters[key]
+
+def dbConvert(dialect, tblName:Base, fields:tuple, rows:list, vector:bool=False) -> tuple:
+    '''
+    Convert a batch of raw CSV rows into typed tuples for executemany
+    :param dialect - SQLAlchemy dialect instance, eg engine.dialect
+    :param tblName - Database tablename
+    :param fields - CSV header, in file order
+    :param rows - CSV rows as dictionaries or sequences in header order
+    :param vector - Convert numeric columns as NumPy arrays when NumPy is installed
+    :return tuple - (columns, list of tuples)
+    :example - columns, data = dbConvert(engine.dialect, Track, header, rows)
+    '''
+    columns, casts, defaults = dbConverter(dialect, tblName, fields)
+    used = columns[0:len(casts)]
+    if len(rows) == 0:
+        return columns, []
+    if isinstance(rows[0], dict):
+        getter = itemgetter(*used)
+    else:
+        getter = itemgetter(*[list(fields).index(c) for c in used])
+    if len(used) == 1:
+        getter = (lambda g: lambda row: (g(row),))(getter)
+    # Python side column defaults, eg Date_Created, are evaluated once per batch
+    extra = tuple(c.default.arg(None) if c.default.is_callable else c.default.arg for c in defaults)
+    if vector and _numpy() is not None:
+        values = list(zip(*map(getter, rows)))
+        for i, cast in enumerate(casts):
+            if cast is not None:
+                values[i] = _dbVector(values[i], cast)
+        data = list(zip(*values))
+    else:
+        data = [tuple(v if cast is None else cast(v) for cast, v in zip(casts, getter(row))) for row in rows]
+    if extra:
+        data = [row + extra for row in data]
+    return columns, data
+
+def _dbVector(values:tuple, cast:callable) -> list:
+    '''
+    Convert one column of raw values with NumPy, falling back to cast on blanks or bad data
+    :param values - Raw column values
+    :param cast - Per value cast from _dbCast
+    :return list - Converted Python values
+    :example - _dbVector(('1','2'), cast)
+    '''
+    np = _numpy()
+    try:
+        probe = cast(values[0])
+        dtype = np.int64 if isinstance(probe, int) else np.float64 if isinstance(probe, float) else None
+        if dtype is None:
+            raise ValueError
+        return np.asarray(values).astype(dtype).tolist()
+    except (ValueError, TypeError):
+        return [cast(v) for v in values]
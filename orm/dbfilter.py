@@ -0,0 +1,171 @@
+import logging
+import sqlalchemy
+import threading
+from functools import lru_cache
+from sqlalchemy import bindparam, delete, inspect, select, update
+from orm.schema import *
+
+# Filter expressions for the filters dictionaries of orm.dbfunctions, compiled to cached Core statements
+#   {'Country':'Brazil'}                 equality, as filter_by
+#   {'GenreId':[1, 2, 3]}                IN list
+#   {'Composer':None}                    IS NULL
+#   {'UnitPrice':{'>=':1, '<':2}}        operators, combined with AND
+#   {'TrackName':{'like':'A%'}}          =, !=, <, <=, >, >=, in, not in, like, not like, between, is, is not
+
+OPERATORS = {
+    '=': lambda col, p: col == p[0],
+    '!=': lambda col, p: col != p[0],
+    '<': lambda col, p: col < p[0],
+    '<=': lambda col, p: col <= p[0],
+    '>': lambda col, p: col > p[0],
+    '>=': lambda col, p: col >= p[0],
+    'in': lambda col, p: col.in_(p[0]),
+    'not in': lambda col, p: col.not_in(p[0]),
+    'like': lambda col, p: col.like(p[0]),
+    'not like': lambda col, p: col.not_like(p[0]),
+    'between': lambda col, p: col.between(p[0], p[1]),
+    'is': lambda col, p: col.is_(None),
+    'is not': lambda col, p: col.isnot(None),
+}
+
+# Bind parameters each operator takes
+_ARITY = {'between': 2, 'is': 0, 'is not': 0}
+
+_usage = {}
+_lock = threading.Lock()
+
+def _filterTerms(filters:dict) -> list:
+    '''
+    Normalise a filters dictionary into (column, operator, operand) terms
+    :param filters - Filter expression dictionary, None or {} for all records
+    :return list - [('ColumnName', 'operator', operand)] in a stable order
+    :example - _filterTerms({'UnitPrice':{'>=':1}})
+    '''
+    terms = []
+    for col, value in (filters or {}).items():
+        if isinstance(value, dict):
+            terms += [(col, op.lower(), operand) for op, operand in value.items()]
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            terms.append((col, 'in', list(value)))
+        elif value is None:
+            terms.append((col, 'is', None))
+        else:
+            terms.append((col, '=', value))
+    return sorted(terms, key=lambda t: (t[0], t[1]))
+
+@lru_cache(maxsize=512)
+def _filterBuild(tblName:Base, kind:str, target:str, shape:tuple):
+    '''
+    Build the statement for one filter shape, cached so repeated shapes skip construction
+    :param tblName - Database tablename
+    :param kind - select, update or delete
+    :param target - Column selected, or column updated, None selects whole records
+    :param shape - ((ColumnName, operator) ...) from _filterTerms
+    :return Statement with bind parameters _f0, _f1 ... & _value for updates
+    :example - _filterBuild(Track, 'select', None, (('UnitPrice', '>='),))
+    '''
+    table = tblName.__table__
+    criteria, n = [], 0
+    for col, op in shape:
+        if col not in table.c:
+            raise ValueError(f'{table.name} has no column {col}')
+        if op not in OPERATORS:
+            raise ValueError(f'Unknown filter operator {op}, expected one of {", ".join(OPERATORS)}')
+        arity = _ARITY.get(op, 1)
+        params = [bindparam(f'_f{n + i}', expanding=op in ('in', 'not in')) for i in range(arity)]
+        criteria.append(OPERATORS[op](table.c[col], params))
+        n += arity
+    if kind == 'select':
+        stmt = select(getattr(tblName, target) if target else tblName)
+    elif kind == 'update':
+        stmt = update(tblName).values({target: bindparam('_value')})
+    else:
+        stmt = delete(tblName)
+    stmt = stmt.where(*criteria)
+    # Sessions running these are short lived, nothing to synchronise
+    return stmt.execution_options(synchronize_session=False) if kind != 'select' else stmt
+
+def filterStatement(tblName:Base, filters:dict, kind:str='select', target:str=None) -> tuple:
+    '''
+    Compile a filter expression into a cached Core statement & its parameters
+    :param tblName - Database tablename
+    :param filters - Filter expression dictionary, None or {} for all records
+    :param kind - select, update or delete
+    :param target - Column selected instead of whole records, or the column an update sets
+    :return tuple - (statement, parameters) for session.execute or conn.execute
+    :example - stmt, params = filterStatement(Track, {'UnitPrice':{'>':1}, 'GenreId':[1, 2]})
+    '''
+    terms = _filterTerms(filters)
+    stmt = _filterBuild(tblName, kind, target, tuple((col, op) for col, op, operand in terms))
+    params, n = {}, 0
+    for col, op, operand in terms:
+        arity = _ARITY.get(op, 1)
+        values = list(operand) if arity == 2 else [operand] if arity == 1 else []
+        if len(values) != arity:
+            raise ValueError(f'Filter {col} {op} expects {arity} values, got {operand}')
+        params.update((f'_f{n + i}', v) for i, v in enumerate(values))
+        n += arity
+    with _lock:
+        for col, op, operand in terms:
+            entry = _usage.setdefault((tblName.__tablename__, col), {'calls': 0, 'ops': set()})
+            entry['calls'] += 1
+            entry['ops'].add(op)
+    return stmt, params
+
+def filterUsage() -> dict:
+    '''
+    How often each column has been filtered on since start up or filterReset
+    :return dict - {('TableName', 'ColumnName'):{'calls':int, 'ops':set}}
+    :example - filterUsage()
+    '''
+    with _lock:
+        return {k: {'calls': v['calls'], 'ops': set(v['ops'])} for k, v in _usage.items()}
+
+def filterReset() -> None:
+    '''
+    Discard recorded filter usage
+    :return None
+    :example - filterReset()
+    '''
+    with _lock:
+        _usage.clear()
+
+def filterAdvise(engine:sqlalchemy.engine, minCalls:int=10, create:bool=False) -> list:
+    '''
+    Suggest indexes for frequently filtered columns that have none, optionally creating them
+    :param engine - SQLAlchemy engine instance
+    :param minCalls - Filtered at least this many times to be worth an index
+    :param create - Create the suggested indexes
+    :return list - [{'table', 'column', 'calls', 'ops', 'index', 'created'}] most used first, or exception
+    :example - filterAdvise(engine, 100, True)
+    '''
+    applog = logging.getLogger('AppLog')
+    models = {m.class_.__tablename__: m.class_ for m in Base.registry.mappers}
+    advice = []
+    try:
+        inspector = inspect(engine)
+        for (tblName, col), entry in sorted(filterUsage().items(), key=lambda kv: kv[1]['calls'], reverse=True):
+            if entry['calls'] < minCalls or tblName not in models:
+                continue
+            table = models[tblName].__table__
+            # Only the leading column of an index serves a filter on its own
+            leading = {idx['column_names'][0] for idx in inspector.get_indexes(tblName) if idx['column_names']}
+            leading |= {c['column_names'][0] for c in inspector.get_unique_constraints(tblName) if c['column_names']}
+            if table.c[col].primary_key or col in leading:
+                continue
+            name = f'ix_{tblName}_{col}'
+            created = False
+            if create:
+                # Plain DDL, so the index is not attached to the shared schema metadata
+                quote = engine.dialect.identifier_preparer.quote
+                with engine.begin() as conn:
+                    conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(tblName)} ({quote(col)})')
+                created = True
+            applog.info(f'{tblName}.{col} filtered {entry["calls"]} times ({", ".join(sorted(entry["ops"]))}) without an index'
+                        + (f', created {name}' if created else f', suggest CREATE INDEX {name} ON {tblName} ({col})'))
+            advice.append({'table': tblName, 'column': col, 'calls': entry['calls'], 'ops': sorted(entry['ops']),
+                           'index': name, 'created': created})
+        return advice
+    except Exception as e:
+        applog.error(e)
+        return e
@@ -1,36 +1,218 @@
+import base64
+import json
 import logging
 import sqlalchemy
-from sqlalchemy import inspect
-from sqlalchemy.orm import Session
+import sqlalchemy.exc
+from decimal import Decimal
+from itertools import islice
+from typing import Iterator
+from sqlalchemy import and_, bindparam, inspect, or_, select, tuple_, update
+from sqlalchemy.orm import Session, joinedload, selectinload
+from lib.apputils import dbManaged, dbSession, logData
+from orm.dbcache import cacheGeneration, cacheGet, cacheInvalidate, cachePut
+from orm.dbconvert import _numpy, dbConverter
+from orm.dbfilter import filterStatement
 from orm.schema import *
+from orm.search import SEARCHABLE, dbSearchTables, searchTable
+from orm.summary import dbSummaryAfter, dbSummaryBefore, dbSummaryIds, dbSummaryRebuild, dbSummaryRegroups
+from raw.csvHelper import csvDictStream, csvDictWriter
 
 # Table level functions
-def dbInsertAll(engine:sqlalchemy.engine, tblName:str, data:Base, verbose:bool) -> int:
+def dbInsertAll(engine:sqlalchemy.engine, tblName:str, data:Base, verbose:bool, chunkSize:int=0, summary:bool=True) -> int:
     '''
     Insert multiple records into database table
     :param engine - SQLAlchemy engine instance
     :param tblName - Database tablename 
-    :param data - SQLALchemy data objects
+    :param data - SQLALchemy data objects, any iterable of mappings when chunkSize is set
     :parma verbose - Enable verbose mode
+    :param chunkSize - Rows committed per transaction, 0 inserts everything in one transaction
+    :param summary - Keep the sales summaries current, bulk loaders turn this off & rebuild them once at the end
     :return int - Number of records inserted or exception
-    :example - dbInsertAll(engine, eval(tblName.title()), dataToImport, verbose)
+    :example - dbInsertAll(engine, eval(tblName.title()), dataToImport, verbose, 10000)
     '''
     applog = logging.getLogger('AppLog')
-    datlog = logging.getLogger('DatLog')
-    with Session(engine) as session:
-        if engine.name == 'sqlite':
+    with dbSession(engine) as session:
+        if engine.name == 'sqlite' and not dbManaged(engine):
             session.execute('pragma foreign_keys=on')
+        if chunkSize:
+            rows = iter(data)
+            total = 0
+            try:
+                chunk = list(islice(rows, chunkSize))
+                while chunk:
+                    # Each commit may hand back a fresh pooled connection without the pragma
+                    if total and engine.name == 'sqlite' and not dbManaged(engine):
+                        session.execute('pragma foreign_keys=on')
+                    session.bulk_insert_mappings(tblName, chunk)
+                    if summary and tblName is Invoiceitem:
+                        dbSummaryAfter(engine, session, None, dbSummaryIds(chunk))
+                    session.commit()
+                    cacheInvalidate(engine, tblName)
+                    total += len(chunk)
+                    applog.info(f'Inserted {len(chunk)} records into {tblName.__tablename__} ... {total} committed')
+                    if verbose:
+                        logData(f'Inserted {tblName.__tablename__}', chunk)
+                    chunk = list(islice(rows, chunkSize))
+                return total
+            except Exception as e:
+                session.rollback()
+                applog.error(f'{tblName.__tablename__} failed after {total} committed records ... {e}')
+                return e
         try:
             session.bulk_insert_mappings(tblName, data)
+            if summary and tblName is Invoiceitem:
+                dbSummaryAfter(engine, session, None, dbSummaryIds(data))
             session.commit()
+            cacheInvalidate(engine, tblName)
             if verbose:
-                datlog.info(data)
+                logData(f'Inserted {tblName.__tablename__}', data)
             return len(data)
         except Exception as e:
             session.rollback()
             applog.error(e)
             return e
 
+def dbInsertRows(engine:sqlalchemy.engine, tblName:Base, columns:tuple, data:list, verbose:bool, chunkSize:int=0, summary:bool=True) -> int:
+    '''
+    Insert typed tuples into database table with executemany, bypassing the ORM
+    :param engine - SQLAlchemy engine instance
+    :param tblName - Database tablename
+    :param columns - Column names, in tuple order
+    :param data - List of tuples, eg from orm.dbconvert.dbConvert
+    :param verbose - Enable verbose mode
+    :param chunkSize - Rows committed per transaction, 0 inserts everything in one transaction
+    :param summary - Keep the sales summaries current, bulk loaders turn this off & rebuild them once at the end
+    :return int - Number of records inserted or exception
+    :example - dbInsertRows(engine, Track, *dbConvert(engine.dialect, Track, header, rows), False)
+    '''
+    applog = logging.getLogger('AppLog')
+    quote = engine.dialect.identifier_preparer.quote
+    marker = '?' if engine.dialect.paramstyle == 'qmark' else '%s'
+    stmt = f'INSERT INTO {quote(tblName.__tablename__)} ({", ".join(quote(c) for c in columns)}) VALUES ({", ".join([marker] * len(columns))})'
+    chunkSize = chunkSize or max(len(data), 1)
+    invoiceId = columns.index('InvoiceId') if summary and tblName is Invoiceitem else None
+    total = 0
+    with engine.connect() as conn:
+        if engine.name == 'sqlite' and not dbManaged(engine):
+            conn.exec_driver_sql('pragma foreign_keys=on')
+        try:
+            for i in range(0, len(data), chunkSize):
+                with conn.begin():
+                    conn.exec_driver_sql(stmt, data[i:i + chunkSize])
+                    if invoiceId is not None:
+                        dbSummaryAfter(engine, conn, None, {row[invoiceId] for row in data[i:i + chunkSize]})
+                cacheInvalidate(engine, tblName)
+                total += len(data[i:i + chunkSize])
+            if verbose:
+                logData(f'Inserted {tblName.__tablename__}', data)
+            return total
+        except Exception as e:
+            applog.error(f'{tblName.__tablename__} failed after {total} committed records ... {e}')
+            return e
+
+def dbUpsertRows(engine:sqlalchemy.engine, tblName:Base, columns:tuple, data:list, key:list, updatable:int, verbose:bool, chunkSize:int=0) -> int:
+    '''
+    Insert typed tuples, updating records that already exist on a unique key
+    :param engine - SQLAlchemy engine instance
+    :param tblName - Database tablename
+    :param columns - Column names, in tuple order
+    :param data - List of tuples, eg from orm.dbconvert.dbConvert
+    :param key - Unique column names to match existing records on
+    :param updatable - Leading columns copied onto existing records, later ones are only used for inserts, eg Date_Created defaults
+    :param verbose - Enable verbose mode
+    :param chunkSize - Rows committed per transaction, 0 upserts everything in one transaction
+    :return int - Number of records inserted or changed, or exception
+    :example - dbUpsertRows(engine, Artist, columns, data, ['ArtistName'], 1, False, 10000)
+    '''
+    applog = logging.getLogger('AppLog')
+    if engine.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif engine.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        e = NotImplementedError(f'Upsert is not supported on {engine.name}')
+        applog.error(e)
+        return e
+    table = tblName.__table__
+    stmt = insert(table)
+    changes = [c for c in columns[0:updatable] if c not in key]
+    if changes:
+        # Only rewrite records whose values actually differ
+        stmt = stmt.on_conflict_do_update(index_elements=key, set_={c: stmt.excluded[c] for c in changes},
+                                          where=or_(*[table.c[c].is_distinct_from(stmt.excluded[c]) for c in changes]))
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=key)
+    chunkSize = chunkSize or max(len(data), 1)
+    total = 0
+    with engine.connect() as conn:
+        if engine.name == 'sqlite' and not dbManaged(engine):
+            conn.exec_driver_sql('pragma foreign_keys=on')
+        try:
+            for i in range(0, len(data), chunkSize):
+                with conn.begin():
+                    results = conn.execute(stmt, [dict(zip(columns, row)) for row in data[i:i + chunkSize]])
+                cacheInvalidate(engine, tblName)
+                total += max(results.rowcount, 0)
+            if verbose:
+                logData(f'Upserted {table.name}', data)
+            return total
+        except Exception as e:
+            applog.error(f'{table.name} failed after {total} committed records ... {e}')
+            return e
+
+def dbInsertSafe(engine:sqlalchemy.engine, tblName:Base, data, verbose:bool, rejectFile:str=None, chunkSize:int=10000, summary:bool=True) -> dict:
+    '''
+    Insert multiple records, isolating failing rows by bisecting failed batches
+    :param engine - SQLAlchemy engine instance
+    :param tblName - Database tablename
+    :param data - Any iterable of mappings, eg csvDictStream
+    :param verbose - Enable verbose mode
+    :param rejectFile - Fully qualified CSV file for rejected rows & their errors, None to only count them
+    :param chunkSize - Rows attempted per transaction
+    :param summary - Keep the sales summaries current, bulk loaders turn this off & rebuild them once at the end
+    :return dict - {'table':'TableName', 'loaded':int, 'rejected':int} or exception
+    :example - dbInsertSafe(engine, Track, csvDictStream('./sam/csv/tracks.csv', False), False, './logs/tracks.rej.csv')
+    '''
+    applog = logging.getLogger('AppLog')
+    counts = {'table': tblName.__tablename__, 'loaded': 0, 'rejected': 0}
+    rejects = []
+    with dbSession(engine) as session:
+        def attempt(batch:list) -> None:
+            if engine.name == 'sqlite' and not dbManaged(engine):
+                session.execute('pragma foreign_keys=on')
+            try:
+                session.bulk_insert_mappings(tblName, batch)
+                if summary and tblName is Invoiceitem:
+                    dbSummaryAfter(engine, session, None, dbSummaryIds(batch))
+                session.commit()
+                counts['loaded'] += len(batch)
+            except (sqlalchemy.exc.IntegrityError, sqlalchemy.exc.DataError) as e:
+                session.rollback()
+                if len(batch) == 1:
+                    counts['rejected'] += 1
+                    rejects.append(dict(batch[0], Error=str(getattr(e, 'orig', e))))
+                else:
+                    attempt(batch[0:len(batch) // 2])
+                    attempt(batch[len(batch) // 2:])
+        rows = iter(data)
+        try:
+            chunk = list(islice(rows, chunkSize))
+            while chunk:
+                attempt(chunk)
+                chunk = list(islice(rows, chunkSize))
+        except Exception as e:
+            session.rollback()
+            applog.error(f'{tblName.__tablename__} failed after {counts["loaded"]} committed records ... {e}')
+            return e
+    cacheInvalidate(engine, tblName)
+    if rejects:
+        applog.warning(f'{tblName.__tablename__} rejected {counts["rejected"]} records, first error ... {rejects[0]["Error"]}')
+        if rejectFile:
+            csvDictWriter(rejectFile, rejects, verbose)
+    if verbose:
+        logData(f'Inserted {tblName.__tablename__}', counts)
+    return counts
+
 def dbSelectAll(engine:Session, tblName:Base, verbose:bool) -> list:
     '''
     Select all records from a database table
@@ -40,18 +222,79 @@ def dbSelectAll(engine:Session, tblName:Base, verbose:bool) -> list:
     :return data - Query results as list
     :example - x = dbSelectAll(engine, Genre, True)
     '''
-    #FIXME DBAPI Events
-    datlog = logging.getLogger('DatLog')
-    with Session(engine) as session:
+    with dbSession(engine) as session:
         data = []
         results = session.query(tblName).all()
         for row in results:
             rowdict = {col: str(getattr(row,col)) for col in row.__table__.c.keys()}
-            if verbose:
-                datlog.info(f'Selected ... {rowdict}')
             data.append(rowdict)
+        if verbose:
+            logData(f'Selected {tblName.__tablename__}', data)
         return data
 
+def dbSelectStream(engine:sqlalchemy.engine, tblName:Base, filters:dict, verbose:bool, chunkSize:int=1000) -> Iterator[dict]:
+    '''
+    Stream records from a database table with native column types
+    :param engine - SQLAlchemy engine instance
+    :param tblName - Database tablename
+    :param filters - Dictionary {'ColumnName':'Criteria'}, or operators as in orm.dbfilter, None or {} for all records
+    :param verbose - Enable verbose mode
+    :param chunkSize - Rows fetched from the cursor at a time
+    :return generator - Yields one dictionary per record
+    :example - for row in dbSelectStream(engine, Invoiceitem, {'InvoiceId':1}, False): ...
+    '''
+    table = tblName.__table__
+    stmt, params = filterStatement(tblName, filters)
+    count = 0
+    sample = []
+    with engine.connect() as conn:
+        results = conn.execution_options(stream_results=True, max_row_buffer=chunkSize).execute(stmt, params)
+        for rows in results.mappings().partitions(chunkSize):
+            if verbose and not sample:
+                sample = [dict(row) for row in rows[0:10]]
+            for row in rows:
+                yield dict(row)
+            count += len(rows)
+    if verbose:
+        logData(f'Streamed {table.name}', sample, count)
+
+def dbSelectColumns(engine:sqlalchemy.engine, tblName:Base, filters:dict, verbose:bool, asArray:bool=False) -> dict:
+    '''
+    Select records from a database table as columns
+    :param engine - SQLAlchemy engine instance
+    :param tblName - Database tablename
+    :param filters - Dictionary {'ColumnName':'Criteria'}, or operators as in orm.dbfilter, None or {} for all records
+    :param verbose - Enable verbose mode
+    :param asArray - Return NumPy arrays instead of lists when NumPy is installed
+    :return dict - {'ColumnName':[values]}
+    :example - x = dbSelectColumns(engine, Invoice, {}, False, True)['Total'].sum()
+    '''
+    table = tblName.__table__
+    data = {col: [] for col in table.c.keys()}
+    appenders = [(col, data[col].append) for col in data]
+    for row in dbSelectStream(engine, tblName, filters, verbose):
+        for col, append in appenders:
+            append(row[col])
+    if asArray and _numpy() is not None:
+        for col in data:
+            data[col] = _npArray(data[col], table.c[col].type.python_type)
+    return data
+
+def _npArray(values:list, pytype:type):
+    '''
+    Convert a column to a typed NumPy array, object dtype if it holds nulls or mixed values
+    :param values - Column values
+    :param pytype - Column python_type
+    :return numpy.ndarray
+    :example - _npArray([1, 2], int)
+    '''
+    np = _numpy()
+    dtype = {int: np.int64, Decimal: np.float64, float: np.float64}.get(pytype, object)
+    try:
+        return np.array(values, dtype=dtype)
+    except (TypeError, ValueError):
+        return np.array(values, dtype=object)
+
 def dbUpdateAll(engine:Session, tblName:Base, updAttr:str, updVal:str, verbose:bool) -> int:
     '''
     Update unfiltered records in a database table
@@ -65,10 +308,13 @@ def dbUpdateAll(engine:Session, tblName:Base, updAttr:str, updVal:str, verbose:b
     '''
     applog = logging.getLogger('AppLog')
     datlog = logging.getLogger('DatLog')
-    with Session(engine) as session:
+    with dbSession(engine) as session:
         try:
             results = session.query(tblName).update({updAttr:updVal})
+            if dbSummaryRegroups(tblName, updAttr):
+                dbSummaryRebuild(session, engine)
             session.commit()
+            cacheInvalidate(engine, tblName)
             if verbose:
                 datlog.info(f'Updated {tblName.__tablename__} table, {updAttr} column contents, to "{updVal}" {results} times')
             return results
@@ -77,24 +323,96 @@ def dbUpdateAll(engine:Session, tblName:Base, updAttr:str, updVal:str, verbose:b
             applog.error(e)
             return(e)
 
-def dbDeleteAll(engine:Session, tblName:Base, verbose:bool) -> int:
+def dbUpdateMany(engine:sqlalchemy.engine, tblName:Base, data, verbose:bool, key:str='Id', chunkSize:int=10000) -> dict:
+    '''
+    Update many records, each with its own columns & values, using executemany in chunked transactions
+    :param engine - SQLAlchemy engine instance
+    :param tblName - Database tablename
+    :param data - Iterable of mappings {key:value, 'ColumnName':'Value' [,...]}, or a CSV file with a key column
+    :param verbose - Enable verbose mode
+    :param key - Column identifying the record to update, usually Id
+    :param chunkSize - Rows committed per transaction
+    :return dict - {'table':'TableName', 'updated':int, 'missing':int} or exception
+    :example - dbUpdateMany(engine, Track, [{'Id':1, 'UnitPrice':1.29}, {'Id':2, 'UnitPrice':1.49, 'Composer':'Anon'}], False)
+    '''
+    applog = logging.getLogger('AppLog')
+    table = tblName.__table__
+    counts = {'table': table.name, 'updated': 0, 'missing': 0}
+    casts = {}
+    if isinstance(data, str):
+        data = csvDictStream(data, verbose)
+        if isinstance(data, Exception):
+            return data
+        casts = None
+    statements = {}
+    regroups = False
+    rows = iter(data)
+    with engine.connect() as conn:
+        if engine.name == 'sqlite' and not dbManaged(engine):
+            conn.exec_driver_sql('pragma foreign_keys=on')
+        try:
+            chunk = list(islice(rows, chunkSize))
+            while chunk:
+                if casts is None:
+                    # CSV values arrive as text, cast them the way dbFill does
+                    columns, fns = dbConverter(engine.dialect, tblName, tuple(chunk[0].keys()))[0:2]
+                    casts = {c: fn for c, fn in zip(columns, fns) if fn is not None}
+                # executemany needs one statement per distinct set of columns
+                groups = {}
+                for row in chunk:
+                    if row.get(key) in (None, ''):
+                        raise ValueError(f'{table.name} update row has no {key} ... {row}')
+                    values = {c: casts[c](v) if c in casts else v for c, v in row.items()}
+                    values['_key'] = values.pop(key)
+                    groups.setdefault(tuple(sorted(values)), []).append(values)
+                with conn.begin():
+                    for columns, params in groups.items():
+                        if columns not in statements:
+                            unknown = [c for c in columns if c != '_key' and c not in table.c]
+                            if unknown:
+                                raise ValueError(f'{table.name} has no column {", ".join(unknown)}')
+                            statements[columns] = update(table).where(table.c[key] == bindparam('_key'))
+                            regroups = regroups or any(dbSummaryRegroups(tblName, c) for c in columns if c != '_key')
+                        results = conn.execute(statements[columns], params)
+                        counts['updated'] += max(results.rowcount, 0)
+                        counts['missing'] += len(params) - max(results.rowcount, 0)
+                cacheInvalidate(engine, tblName)
+                applog.info(f'Updated {counts["updated"]} {table.name} records, {counts["missing"]} missing ... committed')
+                chunk = list(islice(rows, chunkSize))
+            if regroups:
+                with conn.begin():
+                    dbSummaryRebuild(conn, engine)
+        except Exception as e:
+            applog.error(f'{table.name} failed after {counts["updated"]} committed updates ... {e}')
+            return e
+    if verbose:
+        logData(f'Updated {table.name}', counts)
+    return counts
+
+def dbDeleteAll(engine:Session, tblName:Base, verbose:bool, chunkSize:int=0) -> int:
     '''
     Delete all records from table
     :param engine - SQLAlchemy engine instance
     :param tblName - Database tablename 
     :param filters - Dictionary ColumnName Criteria
     :param verbose - Enable verbose mode
+    :param chunkSize - Delete in Id ranges of this many records, committing between them, 0 deletes in one transaction
     :return int - Number of records deleted
     :example - dbDeleteAll(engine, Customer, True)
     '''
+    if chunkSize:
+        return dbDelete(engine, tblName, {}, verbose, chunkSize)
     applog = logging.getLogger('AppLog')
     datlog = logging.getLogger('DatLog') 
-    with Session(engine) as session:
-        if engine.name == 'sqlite':
+    with dbSession(engine) as session:
+        if engine.name == 'sqlite' and not dbManaged(engine):
             session.execute('pragma foreign_keys=on')
         try:
             results = session.query(tblName).delete()
+            if tblName in (Invoice, Invoiceitem):
+                dbSummaryRebuild(session, engine)
             session.commit()
+            cacheInvalidate(engine, tblName)
             if verbose:
                 datlog.info(f'Deleted {tblName.__tablename__} contents ... {results} entries')
             return results
@@ -115,12 +433,16 @@ def dbInsert(engine:Session, data:Base, verbose:bool) -> int:
     '''
     applog = logging.getLogger('AppLog')
     datlog = logging.getLogger('DatLog')
-    with Session(engine) as session:
-        if engine.name == 'sqlite':
+    with dbSession(engine) as session:
+        if engine.name == 'sqlite' and not dbManaged(engine):
             session.execute('pragma foreign_keys=on')
         try:
             session.add(data)
+            if isinstance(data, (Invoice, Invoiceitem)):
+                session.flush()
+                dbSummaryAfter(engine, session, None, dbSummaryIds([data]))
             session.commit()
+            cacheInvalidate(engine, type(data))
             session.refresh(data)
             if verbose:
                 datlog.info(f'Added record number {data.Id} to {data.__tablename__}')
@@ -129,37 +451,227 @@ def dbInsert(engine:Session, data:Base, verbose:bool) -> int:
             session.rollback()
             applog.error(e)
 
-def dbSelect(engine:Session, tblName:Base, filters:dict, verbose:bool) -> list:
+def dbInsertMany(engine:Session, data:list, verbose:bool) -> list:
+    '''
+    Insert a batch of records, with any child records attached through relationships, in one transaction
+    :param engine - SQLAlchemy engine instance
+    :param data - SQLALchemy data objects, eg [Invoice(..., InvoiceItems=[Invoiceitem(...)])]
+    :param verbose - Enable verbose mode
+    :return list - RowIds of inserted records in order, or exception
+    :example - dbInsertMany(engine, [Genre(GenreName='Screaming'), Genre(GenreName='Shouting')], True)
+    '''
+    applog = logging.getLogger('AppLog')
+    datlog = logging.getLogger('DatLog')
+    # Ids are assigned by the flush (RETURNING or cursor lastrowid), no refresh needed after commit
+    with dbSession(engine, expire_on_commit=False) as session:
+        if engine.name == 'sqlite' and not dbManaged(engine):
+            session.execute('pragma foreign_keys=on')
+        try:
+            session.add_all(data)
+            models = {type(row) for row in session.new}
+            session.flush()
+            if Invoice in models or Invoiceitem in models:
+                dbSummaryAfter(engine, session, None, dbSummaryIds(session.identity_map.values()))
+            results = [row.Id for row in data]
+            session.commit()
+            for model in models:
+                cacheInvalidate(engine, model)
+            if verbose:
+                datlog.info(f'Added record numbers {results} to {", ".join(m.__tablename__ for m in models)}')
+            return results
+        except Exception as e:
+            session.rollback()
+            applog.error(e)
+            return e
+
+def dbSelect(engine:Session, tblName:Base, filters:dict, verbose:bool, cache:bool=False) -> list:
     '''
     Select records from a database table
     :param engine - SQLAlchemy engine instance
     :param tblName - Database tablename 
-    :param filters - Dictionary {'ColumnName':'Criteria'}
+    :param filters - Dictionary {'ColumnName':'Criteria'}, or operators as in orm.dbfilter eg {'UnitPrice':{'>':1}}
     :param verbose - Enable verbose mode
+    :param cache - Serve repeated selects from orm.dbcache until the table is written to
     :return data - Query results as list
     :example - x = dbSelect(engine, Customer, {'Country':'Brazil' [,...]}, True)
     '''
-    #FIXME DBAPI Events
     datlog = logging.getLogger('DatLog')
-    with Session(engine) as session:
+    if cache:
+        hit, data = cacheGet(engine, tblName, filters)
+        if not hit:
+            # A write committed while the select runs bumps the generation & the stale result is not stored
+            generation = cacheGeneration(engine, tblName)
+            data = dbSelect(engine, tblName, filters, verbose)
+            cachePut(engine, tblName, filters, data, generation)
+        return [dict(row) for row in data] if data is not None else None
+    with dbSession(engine) as session:
         data = []
-        results = session.query(tblName).filter_by(**filters).all()
+        stmt, params = filterStatement(tblName, filters)
+        results = session.execute(stmt, params).scalars().all()
         if len(results) > 0:
             for row in results:
                 rowdict = {col: str(getattr(row,col)) for col in row.__table__.c.keys()}
                 data.append(rowdict)
-                if verbose:
-                    datlog.info(f'Selected ... {rowdict}')
+            if verbose:
+                logData(f'Selected {tblName.__tablename__}', data)
             return data
         else:
-            datlog.info(f'Missing ... {filters}')
+            datlog.info('Missing ... %s', filters)
+
+def dbSelectPage(engine:sqlalchemy.engine, tblName:Base, filters:dict, pageSize:int, cursor:str, verbose:bool, orderBy:str='Id') -> tuple:
+    '''
+    Select one page of records using keyset pagination
+    :param engine - SQLAlchemy engine instance
+    :param tblName - Database tablename
+    :param filters - Dictionary {'ColumnName':'Criteria'}, or operators as in orm.dbfilter, None or {} for all records
+    :param pageSize - Records per page
+    :param cursor - Continuation cursor from the previous page, None for the first page
+    :param verbose - Enable verbose mode
+    :param orderBy - Id or an indexed column, ties are broken by Id
+    :return tuple - (records as list of dictionaries, cursor for the next page or None)
+    :example - rows, cursor = dbSelectPage(engine, Track, {'AlbumId':1}, 100, cursor, False)
+    '''
+    table = tblName.__table__
+    col = table.c[orderBy]
+    indexed = {idx.columns.values()[0].name for idx in table.indexes}
+    if not (col.primary_key or col.index or col.unique or orderBy in indexed):
+        raise ValueError(f'{table.name}.{orderBy} is not indexed, keyset pagination needs an indexed column')
+    stmt, params = filterStatement(tblName, filters)
+    if cursor:
+        last, lastId = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if col is table.c.Id:
+            stmt = stmt.where(table.c.Id > lastId)
+        elif last is None:
+            # SQLite sorts nulls first, so a null key continues with the remaining nulls then every value
+            stmt = stmt.where(or_(and_(col.is_(None), table.c.Id > lastId), col.isnot(None)))
+        else:
+            stmt = stmt.where(tuple_(col, table.c.Id) > tuple_(last, lastId))
+    stmt = stmt.order_by(col, table.c.Id) if col is not table.c.Id else stmt.order_by(table.c.Id)
+    with engine.connect() as conn:
+        data = [dict(row) for row in conn.execute(stmt.limit(pageSize + 1), params).mappings()]
+    nextCursor = None
+    if len(data) > pageSize:
+        data = data[0:pageSize]
+        key = [data[-1][orderBy], data[-1]['Id']]
+        nextCursor = base64.urlsafe_b64encode(json.dumps(key, default=str).encode()).decode()
+    if verbose:
+        logData(f'Selected page of {table.name} by {orderBy}', data)
+    return data, nextCursor
+
+def _dbGraphOptions(tblName:Base, paths:list) -> tuple:
+    '''
+    Compile relationship paths into eager loader options & the tree of relationships to serialise
+    :param tblName - Database tablename the paths start from
+    :param paths - Dotted relationship paths, eg ['Albums.Tracks']
+    :return tuple - (loader options, {'Relationship':{...}} tree)
+    :example - options, tree = _dbGraphOptions(Artist, ['Albums.Tracks'])
+    '''
+    options, tree = [], {}
+    for path in paths:
+        model, option, branch = tblName, None, tree
+        for name in path.split('.'):
+            rel = inspect(model).relationships.get(name)
+            if rel is None:
+                raise ValueError(f'{model.__tablename__} has no relationship {name} in path {path}')
+            # Collections load with one IN query per level, many-to-one joins into the parent query
+            loader = selectinload if rel.uselist else joinedload
+            attr = getattr(model, name)
+            option = loader(attr) if option is None else getattr(option, loader.__name__)(attr)
+            branch = branch.setdefault(name, {})
+            model = rel.mapper.class_
+        options.append(option)
+    return options, tree
+
+def _dbGraphRow(row:Base, tree:dict) -> dict:
+    '''
+    Flatten a model instance & its loaded relationships into nested dictionaries
+    :param row - SQLAlchemy data object
+    :param tree - Relationships to include, from _dbGraphOptions
+    :return dict - {'ColumnName':'Value', 'Relationship':[{...}] or {...}}
+    :example - _dbGraphRow(artist, {'Albums':{}})
+    '''
+    rowdict = {col: str(getattr(row,col)) for col in row.__table__.c.keys()}
+    for name, branch in tree.items():
+        value = getattr(row, name)
+        if isinstance(value, list):
+            rowdict[name] = [_dbGraphRow(child, branch) for child in value]
+        else:
+            rowdict[name] = _dbGraphRow(value, branch) if value is not None else None
+    return rowdict
+
+def dbSelectGraph(engine:sqlalchemy.engine, tblName:Base, filters:dict, paths:list, verbose:bool) -> list:
+    '''
+    Select records with related records eagerly loaded, one query per relationship level rather than per parent
+    :param engine - SQLAlchemy engine instance
+    :param tblName - Database tablename
+    :param filters - Dictionary {'ColumnName':'Criteria'}, or operators as in orm.dbfilter, None or {} for all records
+    :param paths - Dotted relationship paths to load, eg ['Albums.Tracks']
+    :param verbose - Enable verbose mode
+    :return data - Query results as list of nested dictionaries
+    :example - x = dbSelectGraph(engine, Invoice, {'CustomerId':1}, ['InvoiceItems'], True)
+    '''
+    options, tree = _dbGraphOptions(tblName, paths)
+    with dbSession(engine) as session:
+        stmt, params = filterStatement(tblName, filters)
+        results = session.execute(stmt.options(*options).order_by(tblName.Id), params).unique().scalars().all()
+        data = [_dbGraphRow(row, tree) for row in results]
+    if verbose:
+        logData(f'Selected {tblName.__tablename__} with {", ".join(paths)}', data)
+    return data
+
+def _dbSearchQuery(terms:str) -> str:
+    '''
+    Turn plain search text into an FTS5 query, every word matched as a prefix
+    :param terms - Search text as typed, eg 'love sto'
+    :return str - FTS5 MATCH expression, eg '"love"* "sto"*'
+    :example - _dbSearchQuery('love sto')
+    '''
+    return ' '.join('"' + word.replace('"', '""') + '"*' for word in terms.split())
+
+def dbSearch(engine:sqlalchemy.engine, tblName:Base, terms:str, verbose:bool, pageSize:int=20, page:int=0, raw:bool=False) -> list:
+    '''
+    Full text search of catalogue text columns, best matches first
+    :param engine - SQLAlchemy engine instance
+    :param tblName - Track, Album or Artist
+    :param terms - Search text, each word matched as a prefix, or an FTS5 query when raw is set
+    :param verbose - Enable verbose mode
+    :param pageSize - Records per page
+    :param page - Page number, from 0
+    :param raw - Pass terms to FTS5 unchanged, eg 'TrackName: love NOT Composer: lennon'
+    :return data - Matching records as list of dictionaries with their Rank, lower is better
+    :example - x = dbSearch(engine, Track, 'love sto', True, 20, 0)
+    '''
+    datlog = logging.getLogger('DatLog')
+    if tblName not in SEARCHABLE:
+        raise ValueError(f'{tblName.__tablename__} is not searchable, expected one of {", ".join(m.__tablename__ for m in SEARCHABLE)}')
+    query = terms if raw else _dbSearchQuery(terms)
+    if not query:
+        return []
+    if tblName in dbSearchTables(engine):
+        fts = searchTable(tblName)
+        rank = fts.c.rank
+        stmt = select(tblName, rank).join(fts, fts.c.rowid == tblName.Id) \
+            .where(fts.c[fts.name].op('MATCH')(query)).order_by(rank, tblName.Id)
+    else:
+        # No FTS5 index, eg not SQLite or dbInit without search, fall back to a LIKE scan
+        words = terms.split()
+        rank = sqlalchemy.literal(0)
+        stmt = select(tblName, rank).where(*[or_(*[getattr(tblName, c).like(f'%{w}%') for c in SEARCHABLE[tblName]]) for w in words]) \
+            .order_by(tblName.Id)
+        datlog.info(f'{tblName.__tablename__} has no search index, scanning')
+    with dbSession(engine) as session:
+        results = session.execute(stmt.limit(pageSize).offset(page * pageSize)).all()
+        data = [dict({col: str(getattr(row, col)) for col in row.__table__.c.keys()}, Rank=score) for row, score in results]
+    if verbose:
+        logData(f'Searched {tblName.__tablename__} for {terms}', data)
+    return data
 
 def dbUpdate(engine:Session, tblName:Base, filters:dict, updAttr:str, updVal:str, verbose:bool) -> int:
     '''
     Update filtered records in a database table
     :param engine - SQLAlchemy engine instance
     :param tblName - Database tablename 
-    :param filters - Dictionary {'ColumnName':'Criteria' [,...]}
+    :param filters - Dictionary {'ColumnName':'Criteria' [,...]}, or operators as in orm.dbfilter
     :param updAttr - Table column to update
     :param updVal - New value for table column
     :param verbose - Enable verbose mode
@@ -168,10 +680,17 @@ def dbUpdate(engine:Session, tblName:Base, filters:dict, updAttr:str, updVal:str
     '''
     applog = logging.getLogger('AppLog')
     datlog = logging.getLogger('DatLog')
-    with Session(engine) as session:
+    with dbSession(engine) as session:
         try:
-            results = session.query(tblName).filter_by(**filters).update({updAttr:updVal})
+            touched = dbSummaryBefore(session, tblName, filters)
+            stmt, params = filterStatement(tblName, filters, 'update', updAttr)
+            results = session.execute(stmt, dict(params, _value=updVal)).rowcount
+            if touched is not None:
+                dbSummaryAfter(engine, session, touched, {updVal} if tblName is Invoiceitem and updAttr == 'InvoiceId' else ())
+            elif dbSummaryRegroups(tblName, updAttr):
+                dbSummaryRebuild(session, engine)
             session.commit()
+            cacheInvalidate(engine, tblName)
             if verbose:
                 datlog.info(f'Updated {tblName.__tablename__} table, {updAttr} column contents, to "{updVal}" {results} times')
             return results
@@ -180,26 +699,61 @@ def dbUpdate(engine:Session, tblName:Base, filters:dict, updAttr:str, updVal:str
             applog.error(e)
             return e
 
-def dbDelete(engine:Session, tblName:Base, filters:dict, verbose:bool) -> int:
+def _dbBatches(session:Session, tblName:Base, filters:dict, chunkSize:int) -> Iterator[dict]:
+    '''
+    Split a filtered write into filters for consecutive Id ranges of at most chunkSize records
+    :param session - Session the write runs in
+    :param tblName - Database tablename
+    :param filters - Filter expression dictionary
+    :param chunkSize - Records per batch, 0 for a single batch
+    :return Iterator - Filter expression dictionaries, one per batch
+    :example - for batch in _dbBatches(session, Invoiceitem, {}, 10000): ...
+    '''
+    if not chunkSize:
+        yield filters
+        return
+    stmt, params = filterStatement(tblName, filters, 'select', 'Id')
+    last = None
+    while True:
+        ranged = stmt.where(tblName.Id > last) if last is not None else stmt
+        ids = session.execute(ranged.order_by(tblName.Id).limit(chunkSize), params).scalars().all()
+        if not ids:
+            return
+        last = ids[-1]
+        # Walking the primary key keeps each batch an index range scan, an Id filter of the caller's is kept exact
+        yield dict(filters, Id={'in': ids} if 'Id' in filters else {'between': [ids[0], ids[-1]]})
+
+def dbDelete(engine:Session, tblName:Base, filters:dict, verbose:bool, chunkSize:int=0) -> int:
     '''
     Delete records from a database table
     :param engine - SQLAlchemy engine instance
     :param tblName - Database tablename 
-    :param filters - Dictionary ColumnName Criteria
+    :param filters - Dictionary ColumnName Criteria, or operators as in orm.dbfilter
     :param verbose - Enable verbose mode
+    :param chunkSize - Delete in Id ranges of this many records, committing between them so other writers get the lock
     :return int - Number of records deleted
     :example - dbDelete(engine, Customer, {'Country':'Brazil'}, True)
     '''
     applog = logging.getLogger('AppLog')
     datlog = logging.getLogger('DatLog')
-    with Session(engine) as session:
-        if engine.name == 'sqlite':
+    with dbSession(engine) as session:
+        if engine.name == 'sqlite' and not dbManaged(engine):
             session.execute('pragma foreign_keys=on')
+        results = 0
         try:
-            results = session.query(tblName).filter_by(**filters).delete()
-            session.commit()
+            for batch in _dbBatches(session, tblName, filters, chunkSize):
+                touched = dbSummaryBefore(session, tblName, batch)
+                stmt, params = filterStatement(tblName, batch, 'delete')
+                count = session.execute(stmt, params).rowcount
+                if touched is not None:
+                    dbSummaryAfter(engine, session, touched)
+                session.commit()
+                cacheInvalidate(engine, tblName)
+                results += count
+                if chunkSize:
+                    applog.info(f'Deleted {count} records from {tblName.__tablename__} ... {results} committed')
             if verbose:
-                datlog.info(f'Deleted {list(filters.keys())[0]} = {list(filters.values())[0]} from {tblName.__tablename__} table {results} times')
+                datlog.info(f'Deleted {filters} from {tblName.__tablename__} table {results} times')
             return results
         except Exception as e:
             applog.error(e)
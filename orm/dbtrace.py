@@ -0,0 +1,189 @@
+import atexit
+import bisect
+import logging
+import re
+import sqlalchemy
+import sys
+import threading
+import time
+from functools import lru_cache
+from sqlalchemy import event
+
+# Opt-in per statement & per dbfunction timing, attached through engine cursor events
+
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+_statements = {}
+_callers = {}
+_lock = threading.Lock()
+_settings = {'slowMs': 100.0, 'atExit': 0}
+
+@lru_cache(maxsize=4096)
+def traceNormalise(statement:str) -> str:
+    '''
+    Reduce a SQL statement to its shape, literals & IN lists collapsed
+    :param statement - SQL text as sent to the DBAPI
+    :return str - Normalised statement
+    :example - traceNormalise('SELECT * FROM Tracks WHERE Id IN (1, 2, 3)')
+    '''
+    text = re.sub(r"'(?:[^']|'')*'", '?', statement)
+    text = re.sub(r'\b\d+(?:\.\d+)?\b', '?', text)
+    text = re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(?, ...)', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+def _traceCaller() -> str:
+    '''
+    Find the orm function that issued the statement
+    :return str - Module & function name, or 'other'
+    :example - _traceCaller()
+    '''
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.startswith('orm.') and module != __name__ and frame.f_code.co_name.startswith('db'):
+            return f'{module}.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'other'
+
+def _traceRecord(stats:dict, key:str, ms:float, rows:int) -> None:
+    '''
+    Add one execution to a statistics table
+    :param stats - Statement or caller statistics
+    :param key - Normalised statement or caller name
+    :param ms - Elapsed milliseconds
+    :param rows - Rows written, from the DBAPI rowcount, -1 when unknown
+    :return None
+    :example - _traceRecord(_statements, 'SELECT ...', 1.2, 10)
+    '''
+    entry = stats.get(key)
+    if entry is None:
+        entry = stats[key] = {'calls': 0, 'rows': 0, 'totalMs': 0.0, 'maxMs': 0.0, 'histogram': [0] * (len(BUCKETS) + 1)}
+    entry['calls'] += 1
+    entry['rows'] += max(rows, 0)
+    entry['totalMs'] += ms
+    entry['maxMs'] = max(entry['maxMs'], ms)
+    entry['histogram'][bisect.bisect_right(BUCKETS, ms)] += 1
+
+class _TraceCursor:
+    '''
+    DBAPI cursor proxy counting the rows a SELECT returns, as SQLite reports rowcount -1 for them
+    '''
+    def __init__(self, cursor, shape:str, caller:str):
+        self._cursor, self._keys, self._rows = cursor, (shape, caller), 0
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        self._rows += row is not None
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._rows += len(rows)
+        return rows
+
+    def close(self):
+        # Rows are added once the result is closed, whether exhausted or abandoned part way
+        if self._rows:
+            with _lock:
+                for stats, key in zip((_statements, _callers), self._keys):
+                    if key in stats:
+                        stats[key]['rows'] += self._rows
+            self._rows = 0
+        self._cursor.close()
+
+def _traceBefore(conn, cursor, statement, parameters, context, executemany):
+    '''
+    before_cursor_execute listener, keeps the start time & caller on the statement's execution context
+    '''
+    # The context goes with the statement, so nothing is left behind when it raises & after_cursor_execute never fires
+    if context is not None:
+        context._monty_trace = (time.perf_counter(), _traceCaller())
+
+def _traceAfter(conn, cursor, statement, parameters, context, executemany):
+    '''
+    after_cursor_execute listener, records the elapsed time & flags slow statements, SELECT rows are counted as fetched
+    '''
+    trace = getattr(context, '_monty_trace', None)
+    if trace is None:
+        return
+    start, caller = trace
+    ms = (time.perf_counter() - start) * 1000
+    shape = traceNormalise(statement)
+    if cursor.description is not None:
+        context.cursor = _TraceCursor(cursor, shape, caller)
+        rows = 0
+    else:
+        rows = cursor.rowcount if cursor.rowcount is not None else -1
+    with _lock:
+        _traceRecord(_statements, shape, ms, rows)
+        _traceRecord(_callers, caller, ms, rows)
+    if ms >= _settings['slowMs']:
+        logging.getLogger('AppLog').warning('Slow query %.1fms in %s ... %s', ms, caller, shape)
+
+def traceAttach(engine:sqlalchemy.engine, slowMs:float=100.0, atExit:int=0) -> None:
+    '''
+    Start timing every statement run through an engine
+    :param engine - SQLAlchemy engine instance, the sync_engine of an AsyncEngine
+    :param slowMs - Statements slower than this are logged to AppLog
+    :param atExit - Log a top N report when the interpreter exits, 0 for none
+    :return None
+    :example - traceAttach(engine, 50, 20)
+    '''
+    _settings['slowMs'] = slowMs
+    if not event.contains(engine, 'before_cursor_execute', _traceBefore):
+        event.listen(engine, 'before_cursor_execute', _traceBefore)
+        event.listen(engine, 'after_cursor_execute', _traceAfter)
+    if atExit and not _settings['atExit']:
+        atexit.register(lambda: traceReport(_settings['atExit']))
+    _settings['atExit'] = atExit
+
+def traceDetach(engine:sqlalchemy.engine) -> None:
+    '''
+    Stop timing statements run through an engine, collected statistics are kept
+    :param engine - SQLAlchemy engine instance
+    :return None
+    :example - traceDetach(engine)
+    '''
+    if event.contains(engine, 'before_cursor_execute', _traceBefore):
+        event.remove(engine, 'before_cursor_execute', _traceBefore)
+        event.remove(engine, 'after_cursor_execute', _traceAfter)
+
+def traceReset() -> None:
+    '''
+    Discard collected statistics
+    :return None
+    :example - traceReset()
+    '''
+    with _lock:
+        _statements.clear()
+        _callers.clear()
+
+def traceReport(topN:int=10, orderBy:str='totalMs') -> dict:
+    '''
+    Report the most expensive statements & calling dbfunctions, also written to AppLog
+    :param topN - Entries per section
+    :param orderBy - totalMs, maxMs, calls or rows
+    :return dict - {'statements':[...], 'callers':[...]} each entry with calls, rows, timings & histogram
+    :example - traceReport(20)
+    '''
+    applog = logging.getLogger('AppLog')
+    with _lock:
+        report = {}
+        for section, stats in (('statements', _statements), ('callers', _callers)):
+            top = sorted(stats.items(), key=lambda kv: kv[1][orderBy], reverse=True)[0:topN]
+            report[section] = [dict(v, key=k, meanMs=v['totalMs'] / v['calls']) for k, v in top]
+    labels = [f'<{b}ms' for b in BUCKETS] + [f'>={BUCKETS[-1]}ms']
+    for section, entries in report.items():
+        applog.info('Top %d %s by %s', len(entries), section, orderBy)
+        for e in entries:
+            histogram = ' '.join(f'{l}:{n}' for l, n in zip(labels, e['histogram']) if n)
+            applog.info('%8d calls %10.1fms total %8.2fms mean %8.1fms max %9d rows [%s] %s',
+                        e['calls'], e['totalMs'], e['meanMs'], e['maxMs'], e['rows'], histogram, e['key'])
+    return report
@@ -1,56 +1,399 @@
+import hashlib
+import json
 import logging
 import os
 import sqlalchemy
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from raw.csvHelper import csvDictReader, csvRead
-from sqlalchemy_utils import create_database, database_exists
+from raw.csvHelper import csvDictReader, csvDictStream, csvRead, csvStreamWriter, csvWrite
+from sqlalchemy import inspect, select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateTable
 
-from orm.dbfunctions import dbInsertAll
+from orm.dbconvert import dbConvert, dbConverter
+from orm.dbfunctions import dbInsertAll, dbInsertRows, dbInsertSafe, dbUpsertRows
 from orm.schema import *
+from orm.search import SEARCHABLE, dbSearchCreate, dbSearchRebuild, dbSearchTables, dbSearchTriggers
+from orm.summary import SUMMARIES, dbSummaryRebuild
 
 
-def dbInit(engine:sqlalchemy.engine) -> bool:
+def dbFingerprint(engine:sqlalchemy.engine, search:bool=False) -> int:
     '''
-    Create database shell
+    Fingerprint of the schema dbInit builds, as a signed 32 bit integer for PRAGMA user_version
+    :param engine - SQLAlchemy engine instance, its dialect renders the DDL
+    :param search - Include the FTS5 catalogue search indexes
+    :return int - Non zero fingerprint
+    :example - dbFingerprint(engine)
+    '''
+    ddl = []
+    for t in Base.metadata.sorted_tables:
+        ddl.append(str(CreateTable(t).compile(dialect=engine.dialect)))
+        ddl += sorted(str(CreateIndex(i).compile(dialect=engine.dialect)) for i in t.indexes)
+    if search:
+        ddl += [f'{m.__tablename__}Search {cols}' for m, cols in SEARCHABLE.items()]
+    digest = hashlib.sha256('\n'.join(ddl).encode()).digest()
+    return int.from_bytes(digest[0:4], 'big', signed=True) or 1
+
+def _dbSchemaApply(conn:sqlalchemy.engine.Connection) -> list:
+    '''
+    Bring a database up to the models with one reflection pass, adding missing tables, columns & indexes
+    :param conn - SQLAlchemy connection inside a transaction
+    :return list - Changes applied, eg ['table Tracks', 'index ix_Tracks_AlbumId']
+    :example - _dbSchemaApply(conn)
+    '''
+    inspector = inspect(conn)
+    existing = set(inspector.get_table_names())
+    quote = conn.dialect.identifier_preparer.quote
+    changes = []
+    for t in Base.metadata.sorted_tables:
+        if t.name not in existing:
+            t.create(conn)
+            changes.append(f'table {t.name}')
+            continue
+        columns = {c['name'] for c in inspector.get_columns(t.name)}
+        for col in t.columns:
+            if col.name not in columns:
+                conn.exec_driver_sql(f'ALTER TABLE {quote(t.name)} ADD COLUMN {CreateColumn(col).compile(dialect=conn.dialect)}')
+                changes.append(f'column {t.name}.{col.name}')
+        indexes = {i['name'] for i in inspector.get_indexes(t.name)}
+        for idx in t.indexes:
+            if idx.name not in indexes:
+                idx.create(conn)
+                changes.append(f'index {idx.name}')
+    return changes
+
+def dbInit(engine:sqlalchemy.engine, search:bool=False) -> bool:
+    '''
+    Create database shell, skipping all DDL when the stored schema fingerprint is current
     :param engine - SQLAlchemy engine instance
+    :param search - Also create the SQLite FTS5 catalogue search indexes of orm/search.py
     :return boolean - True or False
-    :example - dbInit(engine)
+    :example - dbInit(engine, True)
     '''
     applog = logging.getLogger('AppLog')
-    if not database_exists(engine.url):
-        create_database(engine.url)
-        Base.metadata.create_all(engine)
-        applog.info(f'Database {engine.url} created at {datetime.today().strftime("%d-%m-%Y %H:%M")}')
-        return True
-    else:
-        for t in Base.metadata.sorted_tables:
-            Base.metadata.create_all(engine, checkfirst=True)
-        applog.info(f'Database {engine.url} updated at at {datetime.today().strftime("%d-%m-%Y %H:%M")}')
+    try:
+        if engine.name == 'sqlite':
+            # Connecting creates the database file, PRAGMA user_version holds the fingerprint
+            fingerprint = dbFingerprint(engine, search)
+            with engine.begin() as conn:
+                if conn.exec_driver_sql('PRAGMA user_version').scalar() == fingerprint:
+                    applog.info(f'Database {engine.url} schema is current')
+                    return True
+                changes = _dbSchemaApply(conn)
+                if search:
+                    before = dbSearchTables(conn)
+                    changes += [f'search {m.__tablename__}Search' for m in dbSearchCreate(conn) if m not in before]
+                conn.exec_driver_sql(f'PRAGMA user_version = {fingerprint}')
+        else:
+            from sqlalchemy_utils import create_database, database_exists
+            if not database_exists(engine.url):
+                create_database(engine.url)
+            with engine.begin() as conn:
+                changes = _dbSchemaApply(conn)
+        if changes:
+            applog.info(f'Database {engine.url} updated at {datetime.today().strftime("%d-%m-%Y %H:%M")} ... {", ".join(changes)}')
+        else:
+            applog.info(f'Database {engine.url} schema is current')
         return True
-    
-def dbFill(engine:sqlalchemy.engine, seed:str, dbName:str, verbose:bool) -> bool:
+    except Exception as e:
+        applog.error(e)
+        return False
+
+def dbFill(engine:sqlalchemy.engine, seed:str, dbName:str, verbose:bool, chunkSize:int=0, rejects:str=None) -> bool:
     '''
     Drop database & reload sample data from samples
     :param engine - SQLAlchemy engine instance
     :param seed - Fully qualified CSV file of files to import
     :param dbName - Database name
     :param verbose - Enable verbose mode
+    :param chunkSize - Stream each file & commit every chunkSize rows, 0 loads each file whole
+    :param rejects - Directory for <file>.rej.csv reject files, loads the good rows of files with bad ones
     :return boolean - True or False
-    :example - dbBuild(dbName, engine, False)
+    :example - dbFill(engine, './sam/csv/import.csv', dbName, False, 10000, './logs/')
     '''
     applog = logging.getLogger('AppLog')
+    paused = None
     try:
         filesToImport = csvRead(seed, verbose)
         if filesToImport is not None:
+            # Search indexes are rebuilt once at the end rather than row by row
+            paused = dbSearchTriggers(engine, False)
             for f in enumerate(filesToImport):
-                dataToImport = csvDictReader(seed[0:seed.rfind('/')+1] + f[1], verbose)
-                tblName = f[1][0:f[1].rfind('.')-1]
-                dbInsertAll(engine, eval(tblName.title()), dataToImport, verbose)
+                if chunkSize or rejects:
+                    dataToImport = csvDictStream(seed[0:seed.rfind('/')+1] + f[1], verbose)
+                else:
+                    dataToImport = csvDictReader(seed[0:seed.rfind('/')+1] + f[1], verbose)
+                name = f[1].removesuffix('.gz')
+                tblName = name[0:name.rfind('.')-1]
+                if rejects:
+                    results = dbInsertSafe(engine, eval(tblName.title()), dataToImport, verbose,
+                                           os.path.join(rejects, name[0:name.rfind('.')] + '.rej.csv'), chunkSize or 10000, False)
+                    if isinstance(results, dict):
+                        applog.info(f'{results["table"]} loaded {results["loaded"]} records, rejected {results["rejected"]}')
+                else:
+                    results = dbInsertAll(engine, eval(tblName.title()), dataToImport, verbose, chunkSize, False)
+                if isinstance(results, Exception):
+                    # Later files reference this one, chunks already committed are kept
+                    applog.error(f'{dbName} population stopped at {f[1]}, {len(filesToImport) - f[0] - 1} files not loaded')
+                    return False
             applog.info(f'{dbName} populated at {datetime.today().strftime("%d-%m-%Y %H:%M")}')
             return True
     except Exception as e:
         applog.error(f'Seed file of sample files could not be found')
         return False
+    finally:
+        # Summaries & search indexes cover whatever was committed, even when loading stopped early
+        if paused is not None:
+            dbSummaryRebuild(engine)
+            if paused:
+                dbSearchRebuild(engine)
+                dbSearchTriggers(engine, True)
+
+def dbModels() -> dict:
+    '''
+    Map database tablenames to their SQLAlchemy model classes
+    :return dict - {'TableName':ModelClass}
+    :example - dbModels()['Tracks']
+    '''
+    return {m.class_.__tablename__: m.class_ for m in Base.registry.mappers}
+
+def _dbSeedFiles(seed:str, verbose:bool) -> dict:
+    '''
+    Match the files listed in a seed file to their tables
+    :param seed - Fully qualified CSV file of files to import
+    :param verbose - Enable verbose mode
+    :return dict - {'TableName':'FilePath'} in foreign key order, None if the seed file is unreadable
+    :example - _dbSeedFiles('./sam/csv/import.csv', False)
+    '''
+    applog = logging.getLogger('AppLog')
+    filesToImport = csvRead(seed, verbose)
+    if not isinstance(filesToImport, list):
+        applog.error(f'Seed file of sample files could not be found')
+        return None
+    tables = {t.name.lower(): t.name for t in Base.metadata.sorted_tables}
+    files = {}
+    for f in filesToImport:
+        name = f.removesuffix('.gz')
+        stem = name[0:name.rfind('.')].lower()
+        if stem in tables:
+            files[tables[stem]] = seed[0:seed.rfind('/')+1] + f
+        else:
+            applog.warning(f'File {f} does not match any table, skipped')
+    return {t.name: files[t.name] for t in Base.metadata.sorted_tables if t.name in files}
+
+def _csvParse(filename:str, tblName:str, url:str) -> tuple:
+    '''
+    Parse & type convert a CSV file for one table, runs in a worker process
+    :param filename - Fully qualified path to CSV file
+    :param tblName - Database tablename
+    :param url - Database URL, used to pick the dialect's type conversions
+    :return tuple - (columns, rows, seconds taken), failures are raised to the parent as RuntimeError
+    :example - columns, rows, secs = _csvParse('./sam/csv/tracks.csv', 'Tracks', 'sqlite:///./db/monty.db')
+    '''
+    start = time.perf_counter()
+    try:
+        rows = csvDictReader(filename, False)
+        if isinstance(rows, Exception):
+            raise rows
+        fields = tuple(rows[0].keys()) if rows else ()
+        dialect = make_url(url).get_dialect()()
+        columns, rows = dbConvert(dialect, dbModels()[tblName], fields, rows, True)
+    except Exception as e:
+        # Logging here only reaches this process's copy of the parent's log queues, so the parent logs it
+        raise RuntimeError(f'{type(e).__name__}: {e}') from None
+    return columns, rows, time.perf_counter() - start
+
+def dbFillParallel(engine:sqlalchemy.engine, seed:str, dbName:str, verbose:bool, workers:int=None, chunkSize:int=0) -> bool:
+    '''
+    Reload sample data, parsing files in a process pool while a single writer inserts them
+    :param engine - SQLAlchemy engine instance
+    :param seed - Fully qualified CSV file of files to import
+    :param dbName - Database name
+    :param verbose - Enable verbose mode
+    :param workers - Parser processes, None for one per CPU
+    :param chunkSize - Commit every chunkSize rows, 0 commits each file whole
+    :return boolean - True or False
+    :example - dbFillParallel(engine, './sam/csv/import.csv', dbName, False, 4)
+    '''
+    applog = logging.getLogger('AppLog')
+    started = time.perf_counter()
+    files = _dbSeedFiles(seed, verbose)
+    if files is None:
+        return False
+    models = dbModels()
+    parse = wait = insert = 0.0
+    success = True
+    paused = dbSearchTriggers(engine, False)
+    from concurrent.futures import ProcessPoolExecutor
+    try:
+        # Insert order follows the foreign key graph, not the seed file order
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            jobs = {t.name: pool.submit(_csvParse, files[t.name], t.name, str(engine.url)) for t in Base.metadata.sorted_tables if t.name in files}
+            for n, (tblName, job) in enumerate(jobs.items()):
+                mark = time.perf_counter()
+                try:
+                    columns, rows, parsed = job.result()
+                except Exception as e:
+                    applog.error(f'{files[tblName]} could not be parsed ... {e}')
+                    results = e
+                else:
+                    waited = time.perf_counter() - mark
+                    mark = time.perf_counter()
+                    results = dbInsertRows(engine, models[tblName], columns, rows, verbose, chunkSize, False)
+                    inserted = time.perf_counter() - mark
+                    parse, wait, insert = parse + parsed, wait + waited, insert + inserted
+                    applog.info(f'{tblName} parsed in {parsed:.3f}s, writer waited {waited:.3f}s, inserted {len(rows)} records in {inserted:.3f}s')
+                if isinstance(results, Exception):
+                    # Later tables reference this one, parses not yet started are cancelled & tables already loaded are kept
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    applog.error(f'{dbName} population stopped at {tblName}, {len(jobs) - n - 1} tables not loaded')
+                    success = False
+                    break
+    finally:
+        dbSummaryRebuild(engine)
+        if paused:
+            dbSearchRebuild(engine)
+            dbSearchTriggers(engine, True)
+    applog.info(f'{dbName} {"populated" if success else "partly populated"} in {time.perf_counter() - started:.3f}s ... parse {parse:.3f}s (across workers), writer wait {wait:.3f}s, insert {insert:.3f}s')
+    return success
+
+def dbNaturalKey(tblName:Base) -> list:
+    '''
+    Natural key of a model, its first unique column, else a declared UniqueConstraint, else Id
+    :param tblName - Database tablename
+    :return list - Key column names
+    :example - dbNaturalKey(Artist)
+    '''
+    for col in tblName.__table__.columns:
+        if col.unique:
+            return [col.name]
+    for constraint in tblName.__table__.constraints:
+        if isinstance(constraint, sqlalchemy.UniqueConstraint):
+            return [col.name for col in constraint.columns]
+    return ['Id']
+
+def _dbHash(filename:str) -> str:
+    '''
+    SHA-256 of a file's contents
+    :param filename - Fully qualified path to file
+    :return str - Hex digest
+    :example - _dbHash('./sam/csv/tracks.csv')
+    '''
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def dbRefresh(engine:sqlalchemy.engine, seed:str, dbName:str, verbose:bool, manifest:str=None, chunkSize:int=10000) -> bool:
+    '''
+    Incrementally re-import sample files, skipping unchanged files & upserting changed ones on their natural key
+    :param engine - SQLAlchemy engine instance
+    :param seed - Fully qualified CSV file of files to import
+    :param dbName - Database name
+    :param verbose - Enable verbose mode
+    :param manifest - JSON file of file hashes from the last refresh, default import.manifest.json beside the seed file
+    :param chunkSize - Rows upserted per transaction
+    :return boolean - True or False
+    :example - dbRefresh(engine, './sam/csv/import.csv', dbName, False)
+    '''
+    applog = logging.getLogger('AppLog')
+    files = _dbSeedFiles(seed, verbose)
+    if files is None:
+        return False
+    manifest = manifest or seed[0:seed.rfind('/')+1] + 'import.manifest.json'
+    hashes = {}
+    if os.path.exists(manifest):
+        with open(manifest, encoding='utf8') as f:
+            hashes = json.load(f)
+    models = dbModels()
+    success = True
+    changed = False
+    for tblName, filename in files.items():
+        digest = _dbHash(filename)
+        if hashes.get(filename) == digest:
+            applog.info(f'{filename} unchanged, {tblName} skipped')
+            continue
+        rows = csvDictReader(filename, verbose)
+        if isinstance(rows, Exception):
+            success = False
+            continue
+        key = dbNaturalKey(models[tblName])
+        fields = tuple(rows[0].keys()) if rows else ()
+        if key == ['Id'] and 'Id' not in fields:
+            # Matching on row position would overwrite every record after an inserted or removed line
+            applog.warning(f'{filename} has no Id column & {tblName} no natural key, skipped, reload it with dbFill')
+            continue
+        columns, data = dbConvert(engine.dialect, models[tblName], fields, rows)
+        # Only the file's own columns are updated, defaults such as Date_Created are for inserts
+        updatable = len(dbConverter(engine.dialect, models[tblName], fields)[1])
+        results = dbUpsertRows(engine, models[tblName], columns, data, key, updatable, verbose, chunkSize)
+        if isinstance(results, Exception):
+            success = False
+            continue
+        changed = True
+        hashes[filename] = digest
+        with open(manifest, 'w', encoding='utf8') as f:
+            json.dump(hashes, f, indent=2)
+        applog.info(f'{filename} changed, {results} {tblName} records inserted or updated on {", ".join(key)}')
+    if changed:
+        dbSummaryRebuild(engine)
+    applog.info(f'{dbName} refreshed at {datetime.today().strftime("%d-%m-%Y %H:%M")}')
+    return success
+
+def dbExport(engine:sqlalchemy.engine, tblName:Base, filename:str, verbose:bool, chunkSize:int=10000) -> int:
+    '''
+    Stream a table straight from the database cursor to a CSV file
+    :param engine - SQLAlchemy engine instance
+    :param tblName - Database tablename
+    :param filename - Fully qualified CSV file, gzip compressed when it ends in .gz
+    :param verbose - Enable verbose mode
+    :param chunkSize - Rows fetched & written at a time
+    :return int - Number of records exported or exception
+    :example - dbExport(engine, Invoiceitem, './exp/invoiceitems.csv.gz', False)
+    '''
+    applog = logging.getLogger('AppLog')
+    table = tblName.__table__
+    try:
+        with engine.connect() as conn:
+            results = conn.execution_options(stream_results=True, max_row_buffer=chunkSize).execute(select(table).order_by(table.c.Id))
+            count = csvStreamWriter(filename, list(results.keys()), (list(rows) for rows in results.partitions(chunkSize)), verbose)
+        if not isinstance(count, Exception):
+            applog.info(f'Exported {count} {table.name} records to {filename}')
+        return count
+    except Exception as e:
+        applog.error(e)
+        return e
+
+def dbExportAll(engine:sqlalchemy.engine, outdir:str, verbose:bool, tables:list=None, compress:bool=False, workers:int=4) -> bool:
+    '''
+    Export tables concurrently into a directory, with an import.csv manifest dbFill can reload
+    :param engine - SQLAlchemy engine instance
+    :param outdir - Directory to write the CSV files to
+    :param verbose - Enable verbose mode
+    :param tables - Models to export, None for every table except the derived sales summaries
+    :param compress - Write gzip compressed .csv.gz files
+    :param workers - Tables exported at once
+    :return boolean - True or False
+    :example - dbExportAll(engine, './exp/', False, compress=True)
+    '''
+    applog = logging.getLogger('AppLog')
+    models = dbModels()
+    wanted = {m.__tablename__ for m in tables} if tables else set(models) - {m.__tablename__ for m in SUMMARIES}
+    names = [t.name for t in Base.metadata.sorted_tables if t.name in wanted]
+    files = {t: t.lower() + ('.csv.gz' if compress else '.csv') for t in names}
+    os.makedirs(outdir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        jobs = {t: pool.submit(dbExport, engine, models[t], os.path.join(outdir, files[t]), verbose) for t in names}
+        failed = [t for t, job in jobs.items() if isinstance(job.result(), Exception)]
+    if failed:
+        applog.error(f'Export of {", ".join(failed)} failed, no manifest written')
+        return False
+    # Manifest lists files in foreign key order so dbFill reloads parents first
+    csvWrite(os.path.join(outdir, 'import.csv'), [files[t] for t in names], verbose)
+    applog.info(f'Exported {len(names)} tables to {outdir}')
+    return True
 
 def dbKill(filename:str) -> bool:
     '''
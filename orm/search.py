@@ -0,0 +1,113 @@
+import sqlalchemy
+from sqlalchemy import column, table
+from orm.schema import *
+
+# SQLite FTS5 indexes over catalogue text columns, external content tables kept in sync by triggers
+
+SEARCHABLE = {Track: ('TrackName', 'Composer'), Album: ('Title',), Artist: ('ArtistName',)}
+
+def searchTable(tblName:Base) -> sqlalchemy.sql.expression.TableClause:
+    '''
+    Lightweight table construct for a model's FTS5 index, eg TracksSearch
+    :param tblName - Searchable database tablename
+    :return TableClause - With rowid, rank & the hidden column named after the table for MATCH
+    :example - fts = searchTable(Track)
+    '''
+    name = tblName.__tablename__ + 'Search'
+    return table(name, column('rowid'), column('rank'), column(name), *[column(c) for c in SEARCHABLE[tblName]])
+
+def _searchTriggers(tblName:Base) -> dict:
+    '''
+    Trigger DDL keeping one FTS5 index in step with its content table
+    :param tblName - Searchable database tablename
+    :return dict - {'TriggerName':'CREATE TRIGGER ...'}
+    :example - _searchTriggers(Track)
+    '''
+    src, fts, cols = tblName.__tablename__, tblName.__tablename__ + 'Search', SEARCHABLE[tblName]
+    names = ', '.join(cols)
+    new = ', '.join(f'new.{c}' for c in cols)
+    old = ', '.join(f'old.{c}' for c in cols)
+    insert = f"INSERT INTO {fts}(rowid, {names}) VALUES (new.Id, {new});"
+    delete = f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.Id, {old});"
+    return {f'{fts}_ai': f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {src} BEGIN {insert} END',
+            f'{fts}_ad': f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {src} BEGIN {delete} END',
+            f'{fts}_au': f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {names} ON {src} BEGIN {delete} {insert} END'}
+
+def _searchConn(conn, fn:callable, *args) -> object:
+    '''
+    Run a function in its own transaction when given an engine, else on the caller's connection
+    :param conn - SQLAlchemy engine or connection
+    :param fn - Function taking a connection & args
+    :param args - Further arguments for fn
+    :return object - Whatever fn returned
+    :example - _searchConn(engine, run)
+    '''
+    if isinstance(conn, sqlalchemy.engine.Engine):
+        with conn.begin() as c:
+            return fn(c, *args)
+    return fn(conn, *args)
+
+def dbSearchTables(conn) -> list:
+    '''
+    Searchable models whose FTS5 index exists in the database
+    :param conn - SQLAlchemy engine or connection
+    :return list - Models, empty on databases other than SQLite or without search
+    :example - dbSearchTables(engine)
+    '''
+    if conn.dialect.name != 'sqlite':
+        return []
+    def run(c):
+        names = {row[0] for row in c.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        return [m for m in SEARCHABLE if m.__tablename__ + 'Search' in names]
+    return _searchConn(conn, run)
+
+def dbSearchCreate(conn) -> list:
+    '''
+    Create the FTS5 indexes & their triggers, indexing any rows already loaded
+    :param conn - SQLAlchemy engine or connection to a SQLite database
+    :return list - Models made searchable
+    :example - dbSearchCreate(engine)
+    '''
+    def run(c):
+        existing = dbSearchTables(c)
+        for tblName, cols in SEARCHABLE.items():
+            fts = tblName.__tablename__ + 'Search'
+            c.exec_driver_sql(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({', '.join(cols)}, "
+                              f"content='{tblName.__tablename__}', content_rowid='Id')")
+            if tblName not in existing:
+                c.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+            for ddl in _searchTriggers(tblName).values():
+                c.exec_driver_sql(ddl)
+        return list(SEARCHABLE)
+    return _searchConn(conn, run)
+
+def dbSearchTriggers(conn, enable:bool) -> list:
+    '''
+    Drop or recreate the sync triggers of existing FTS5 indexes, eg around bulk loads
+    :param conn - SQLAlchemy engine or connection
+    :param enable - True creates the triggers, False drops them
+    :return list - Models affected
+    :example - paused = dbSearchTriggers(engine, False)
+    '''
+    def run(c):
+        models = dbSearchTables(c)
+        for tblName in models:
+            for name, ddl in _searchTriggers(tblName).items():
+                c.exec_driver_sql(ddl if enable else f'DROP TRIGGER IF EXISTS {name}')
+        return models
+    return _searchConn(conn, run)
+
+def dbSearchRebuild(conn) -> list:
+    '''
+    Rebuild existing FTS5 indexes in bulk from their content tables
+    :param conn - SQLAlchemy engine or connection
+    :return list - Models rebuilt
+    :example - dbSearchRebuild(engine)
+    '''
+    def run(c):
+        models = dbSearchTables(c)
+        for tblName in models:
+            fts = tblName.__tablename__ + 'Search'
+            c.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        return models
+    return _searchConn(conn, run)
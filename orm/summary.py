@@ -0,0 +1,226 @@
+import sqlalchemy
+from sqlalchemy import Column, Integer, Numeric, String, delete, func, insert, select
+from orm.dbcache import cacheInvalidate
+from orm.dbfilter import filterStatement
+from orm.schema import *
+
+# Sales Summary Schema, derived from InvoiceItems & maintained by orm.dbfunctions writes
+
+class Salesbyartist(Base):
+    '''
+    Sales per Recording Artist
+    '''
+    __tablename__ = 'SalesByArtist'
+    ArtistId = Column(Integer, primary_key=True, nullable=False)
+    Revenue = Column(Numeric(12, 2), nullable=False)
+    Quantity = Column(Integer, nullable=False)
+    Items = Column(Integer, nullable=False)
+
+class Salesbygenre(Base):
+    '''
+    Sales per Musical Style
+    '''
+    __tablename__ = 'SalesByGenre'
+    GenreId = Column(Integer, primary_key=True, nullable=False)
+    Revenue = Column(Numeric(12, 2), nullable=False)
+    Quantity = Column(Integer, nullable=False)
+    Items = Column(Integer, nullable=False)
+
+class Salesbycountry(Base):
+    '''
+    Sales per Billing Country
+    '''
+    __tablename__ = 'SalesByCountry'
+    BillingCountry = Column(String(40), primary_key=True, nullable=False)
+    Revenue = Column(Numeric(12, 2), nullable=False)
+    Quantity = Column(Integer, nullable=False)
+    Items = Column(Integer, nullable=False)
+
+class Salesbymonth(Base):
+    '''
+    Sales per Invoice Month, YYYY-MM
+    '''
+    __tablename__ = 'SalesByMonth'
+    Month = Column(String(7), primary_key=True, nullable=False)
+    Revenue = Column(Numeric(12, 2), nullable=False)
+    Quantity = Column(Integer, nullable=False)
+    Items = Column(Integer, nullable=False)
+
+SUMMARIES = (Salesbyartist, Salesbygenre, Salesbycountry, Salesbymonth)
+
+def _sumKeys() -> dict:
+    '''
+    Grouping expression of each summary table
+    :return dict - {SummaryModel:ColumnExpression}
+    :example - _sumKeys()[Salesbyartist]
+    '''
+    # InvoiceDate is held as dd/mm/yyyy hh:mm
+    month = func.substr(Invoice.InvoiceDate, 7, 4, type_=String).concat('-').concat(func.substr(Invoice.InvoiceDate, 4, 2, type_=String))
+    return {Salesbyartist: Album.ArtistId, Salesbygenre: Track.GenreId,
+            Salesbycountry: Invoice.BillingCountry, Salesbymonth: month}
+
+def _sumJoin():
+    '''
+    InvoiceItems joined to every table a summary groups by
+    :return Join
+    :example - select(...).select_from(_sumJoin())
+    '''
+    return Invoiceitem.__table__.join(Track.__table__, Track.Id == Invoiceitem.TrackId) \
+        .join(Album.__table__, Album.Id == Track.AlbumId) \
+        .join(Invoice.__table__, Invoice.Id == Invoiceitem.InvoiceId)
+
+def _sumSelect(model:Base, keyExpr, keys:set=None):
+    '''
+    Aggregate query for one summary table, optionally limited to some keys
+    :param model - Summary model
+    :param keyExpr - Grouping expression from _sumKeys
+    :param keys - Key values to aggregate, None for all
+    :return Select
+    :example - _sumSelect(Salesbyartist, Album.ArtistId, {1, 2})
+    '''
+    stmt = select(keyExpr, func.round(func.sum(Invoiceitem.UnitPrice * Invoiceitem.Quantity), 2),
+                  func.sum(Invoiceitem.Quantity), func.count()).select_from(_sumJoin()).where(keyExpr.isnot(None))
+    if keys is not None:
+        stmt = stmt.where(keyExpr.in_(keys))
+    return stmt.group_by(keyExpr)
+
+def dbSummaryInvalidate(engine:sqlalchemy.engine) -> None:
+    '''
+    Drop cached selects of every sales summary table
+    :param engine - SQLAlchemy engine instance
+    :return None
+    :example - dbSummaryInvalidate(engine)
+    '''
+    for model in SUMMARIES:
+        cacheInvalidate(engine, model)
+
+def dbSummaryRebuild(conn, engine:sqlalchemy.engine=None) -> bool:
+    '''
+    Rebuild every sales summary table in bulk, dropping their cached selects
+    :param conn - SQLAlchemy engine, or a connection or session to rebuild inside its transaction
+    :param engine - Engine whose cache to invalidate when conn is a connection or session, None for none
+    :return boolean - True or False
+    :example - dbSummaryRebuild(engine)
+    '''
+    if isinstance(conn, sqlalchemy.engine.Engine):
+        with conn.begin() as c:
+            dbSummaryRebuild(c)
+        dbSummaryInvalidate(conn)
+        return True
+    for model, keyExpr in _sumKeys().items():
+        table = model.__table__
+        conn.execute(delete(table))
+        conn.execute(insert(table).from_select([c.name for c in table.columns], _sumSelect(model, keyExpr)))
+    if engine is not None:
+        dbSummaryInvalidate(engine)
+    return True
+
+def dbSummaryKeys(conn, invoiceIds:set) -> dict:
+    '''
+    Summary rows fed by the items of some invoices
+    :param conn - SQLAlchemy connection or session
+    :param invoiceIds - Invoice Ids
+    :return dict - {SummaryModel:set of keys}
+    :example - keys = dbSummaryKeys(session, {1, 2})
+    '''
+    sumKeys = _sumKeys()
+    keys = {model: set() for model in sumKeys}
+    ids = sorted(i for i in invoiceIds if i is not None)
+    for i in range(0, len(ids), 500):
+        stmt = select(*sumKeys.values()).distinct().select_from(_sumJoin()).where(Invoiceitem.InvoiceId.in_(ids[i:i + 500]))
+        for row in conn.execute(stmt):
+            for model, value in zip(sumKeys, row):
+                keys[model].add(value)
+    return keys
+
+def dbSummaryRefresh(conn, keys:dict) -> int:
+    '''
+    Recompute only the given summary rows, inside the caller's transaction
+    :param conn - SQLAlchemy connection or session
+    :param keys - {SummaryModel:set of keys}, eg merged dbSummaryKeys results from before & after a write
+    :return int - Number of summary keys recomputed
+    :example - dbSummaryRefresh(session, keys)
+    '''
+    count = 0
+    for model, keyExpr in _sumKeys().items():
+        values = sorted(v for v in keys.get(model, ()) if v is not None)
+        table = model.__table__
+        key = table.primary_key.columns.values()[0]
+        for i in range(0, len(values), 500):
+            batch = set(values[i:i + 500])
+            conn.execute(delete(table).where(key.in_(batch)))
+            conn.execute(insert(table).from_select([c.name for c in table.columns], _sumSelect(model, keyExpr, batch)))
+        count += len(values)
+    return count
+
+def dbSummaryInvoices(conn, tblName:Base, filters:dict) -> set:
+    '''
+    Invoice Ids whose items a filtered Invoice or Invoiceitem write touches
+    :param conn - SQLAlchemy connection or session
+    :param tblName - Invoice or Invoiceitem
+    :param filters - Dictionary {'ColumnName':'Criteria'}
+    :return set - Invoice Ids
+    :example - dbSummaryInvoices(session, Invoiceitem, {'TrackId':1})
+    '''
+    stmt, params = filterStatement(tblName, filters, 'select', 'Id' if tblName is Invoice else 'InvoiceId')
+    return set(conn.execute(stmt, params).scalars())
+
+def dbSummaryBefore(conn, tblName:Base, filters:dict) -> tuple:
+    '''
+    Capture the summary rows a filtered write is about to affect
+    :param conn - SQLAlchemy connection or session the write runs in
+    :param tblName - Database tablename
+    :param filters - Dictionary {'ColumnName':'Criteria'}
+    :return tuple - (invoice Ids, summary keys), None for tables the summaries do not use
+    :example - touched = dbSummaryBefore(session, Invoiceitem, {'InvoiceId':1})
+    '''
+    if tblName not in (Invoice, Invoiceitem):
+        return None
+    ids = dbSummaryInvoices(conn, tblName, filters)
+    return ids, dbSummaryKeys(conn, ids)
+
+def dbSummaryAfter(engine:sqlalchemy.engine, conn, touched:tuple, ids:set=()) -> None:
+    '''
+    Recompute the summary rows affected before & after a write, inside its transaction
+    :param engine - SQLAlchemy engine instance, its cached summary selects are dropped
+    :param conn - SQLAlchemy connection or session the write runs in
+    :param touched - Result of dbSummaryBefore, or None to only consider ids
+    :param ids - Further invoice Ids the write added items to
+    :return None
+    :example - dbSummaryAfter(engine, session, touched)
+    '''
+    before, keys = touched if touched is not None else (set(), {})
+    ids = before | {int(i) for i in ids if i not in (None, '')}
+    if not ids:
+        return
+    after = dbSummaryKeys(conn, ids)
+    dbSummaryRefresh(conn, {m: after[m] | keys.get(m, set()) for m in after})
+    dbSummaryInvalidate(engine)
+
+def dbSummaryRegroups(tblName:Base, updAttr:str) -> bool:
+    '''
+    Whether an update needs the sales summaries rebuilt, eg moving tracks between genres
+    :param tblName - Database tablename
+    :param updAttr - Table column to update
+    :return boolean - True when the summaries need a rebuild
+    :example - dbSummaryRegroups(Track, 'GenreId')
+    '''
+    return tblName in (Invoice, Invoiceitem) or (tblName is Track and updAttr in ('AlbumId', 'GenreId')) \
+        or (tblName is Album and updAttr == 'ArtistId')
+
+def dbSummaryIds(rows:list) -> set:
+    '''
+    Invoice Ids of inserted Invoice & Invoiceitem objects or Invoiceitem mappings
+    :param rows - SQLAlchemy data objects or mappings
+    :return set - Invoice Ids
+    :example - dbSummaryIds([Invoiceitem(InvoiceId=1, ...)])
+    '''
+    ids = set()
+    for row in rows:
+        if isinstance(row, Invoice):
+            ids.add(row.Id)
+        elif isinstance(row, Invoiceitem):
+            ids.add(row.InvoiceId)
+        elif isinstance(row, dict):
+            ids.add(row.get('InvoiceId'))
+    return ids
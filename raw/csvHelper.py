@@ -1,4 +1,18 @@
-import csv, logging
+import csv, gzip, logging
+from lib.applog import logData
+from typing import Iterator
+
+def _csvOpen(filename:str, mode:str='r'):
+    '''
+    Open a CSV file as text, gzip compressed when the name ends in .gz
+    :param filename - Fully qualified path to CSV file
+    :param mode - 'r' or 'w'
+    :return file object
+    :example - with _csvOpen('MyFileName.csv.gz', 'w') as f: ...
+    '''
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 't', newline='', encoding='utf8')
+    return open(filename, mode, newline='', encoding='utf8')
 
 def csvRead(filename:str, verbose:bool) -> list:
     '''
@@ -9,15 +23,14 @@ def csvRead(filename:str, verbose:bool) -> list:
     :example - csvRead('MyFileName.csv', True)
     '''
     applog = logging.getLogger('AppLog')
-    datlog = logging.getLogger('DatLog')
     data = []
     try:
-        with open(filename, encoding='utf8') as f:
+        with _csvOpen(filename) as f:
             reader = csv.reader(f)
             for row in reader:
                 data.append(', '.join(row))
         if verbose:
-            datlog.info(data)
+            logData(f'Read {filename}', data)
         return data
     except Exception as e:
         applog.error(e)
@@ -33,14 +46,13 @@ def csvWrite(filename:str, data:list, verbose:bool) -> int:
     :example - csvWrite('MyFileName.csv', data, True)
     '''
     applog = logging.getLogger('AppLog')
-    datlog = logging.getLogger('DatLog')
     try:
         with open(filename,'w', newline='', encoding='utf8') as f:
             writer = csv.writer(f)
             for i in range(len(data)):
                 writer.writerow([data[i]])
         if verbose:
-            datlog.info(data)
+            logData(f'Wrote {filename}', data)
             #FIXME csvWrite Return boolean
         return 1
     except Exception as e:
@@ -56,15 +68,14 @@ def csvDictReader(filename:str, verbose:bool) -> list:
     :example - csvDictReader('MyFileName.csv', True)
     '''
     applog = logging.getLogger('AppLog')
-    datlog = logging.getLogger('DatLog')
     data = []
     try:
-        with open(filename, encoding='utf8') as f:
+        with _csvOpen(filename) as f:
             reader = csv.DictReader(f)
             for row in reader:
                 data.append(row)
         if verbose:
-            datlog.info(data)
+            logData(f'Read {filename}', data)
         return data
     except Exception as e:
         applog.error(e)
@@ -80,7 +91,6 @@ def csvDictWriter(filename:str, data:dict, verbose:bool) -> int:
     :example - csvDictWriter('MyFileName.csv', data, True)
     '''
     applog = logging.getLogger('AppLog')
-    datlog = logging.getLogger('DatLog')
     try:
         with open(filename, 'w', newline='', encoding='utf8') as f:
             fieldnames = data[0]
@@ -88,10 +98,63 @@ def csvDictWriter(filename:str, data:dict, verbose:bool) -> int:
             writer.writeheader()
             writer.writerows(data)
             if verbose:
-                datlog.info(data)
-                print(data)
+                logData(f'Wrote {filename}', data)
         #FIXME csvDictWriter Return boolean
         return 1
     except Exception as e:
         applog.error(e)
-        return e
\ No newline at end of file
+        return e
+
+def csvDictStream(filename:str, verbose:bool) -> Iterator[dict]:
+    '''
+    Stream CSV file as dictionaries, one row at a time
+    :param filename - Fully qualified path to CSV file
+    :param verbose - Enable verbose mode
+    :return generator - Yields one dictionary per row
+    :example - for row in csvDictStream('MyFileName.csv', True): ...
+    '''
+    applog = logging.getLogger('AppLog')
+    count = 0
+    sample = []
+    try:
+        with _csvOpen(filename) as f:
+            for row in csv.DictReader(f):
+                if verbose and count < 10:
+                    sample.append(row)
+                count += 1
+                yield row
+        if verbose:
+            logData(f'Streamed {filename}', sample, count)
+    except Exception as e:
+        applog.error(e)
+        raise
+
+def csvStreamWriter(filename:str, fieldnames:list, rows, verbose:bool) -> int:
+    '''
+    Write CSV file from an iterable of row sequences without holding it in memory
+    :param filename - Fully qualified path to OS directory, gzip compressed when it ends in .gz
+    :param fieldnames - Header row
+    :param rows - Iterable of row sequences, or of lists of row sequences
+    :param verbose - Enable verbose mode
+    :return int - Number of rows written or exception
+    :example - csvStreamWriter('MyFileName.csv.gz', ['Id','Name'], rows, True)
+    '''
+    applog = logging.getLogger('AppLog')
+    count = 0
+    try:
+        with _csvOpen(filename, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(fieldnames)
+            for row in rows:
+                if isinstance(row, list):
+                    writer.writerows(row)
+                    count += len(row)
+                else:
+                    writer.writerow(row)
+                    count += 1
+        if verbose:
+            logData(f'Wrote {filename}', fieldnames, count)
+        return count
+    except Exception as e:
+        applog.error(e)
+        return e
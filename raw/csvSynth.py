@@ -0,0 +1,94 @@
+import csv, logging, os, random
+from raw.csvHelper import csvWrite
+
+# Row counts of the sam/csv sample files, generated files scale from these
+SAMPLE = {'artists': 275, 'genres': 25, 'mediatypes': 5, 'playlists': 14, 'albums': 347, 'employees': 8,
+          'customers': 59, 'invoices': 412, 'tracks': 3503, 'invoiceitems': 2240, 'playlisttracks': 8715}
+
+# Reference tables keep their sample size at every scale
+FIXED = ('genres', 'mediatypes')
+
+COUNTRIES = ('Brazil', 'Germany', 'Canada', 'Norway', 'Czech Republic', 'Austria', 'Belgium', 'Denmark', 'USA',
+             'Portugal', 'France', 'Finland', 'Hungary', 'Ireland', 'Italy', 'Netherlands', 'Poland', 'Spain',
+             'Sweden', 'United Kingdom', 'Australia', 'Argentina', 'Chile', 'India')
+
+def _csvRows(filename:str, header:list, rows) -> int:
+    '''
+    Stream generated rows to a CSV file
+    :param filename - Fully qualified path to CSV file
+    :param header - Column names
+    :param rows - Iterable of row sequences
+    :return int - Number of rows written
+    :example - _csvRows('./artists.csv', ['ArtistName'], rows)
+    '''
+    count = 0
+    with open(filename, 'w', newline='', encoding='utf8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+def _csvDate(rnd:random.Random) -> str:
+    '''
+    Random date in the sample file format
+    :param rnd - Seeded random generator
+    :return str - Date as dd/mm/yyyy 00:00
+    :example - _csvDate(random.Random(42))
+    '''
+    return f'{rnd.randint(1, 28):02d}/{rnd.randint(1, 12):02d}/{rnd.randint(2009, 2013)} 00:00'
+
+def csvSynth(outdir:str, scale:int, seed:int, verbose:bool) -> str:
+    '''
+    Generate referentially consistent sample CSVs for every model in orm/schema.py
+    :param outdir - Directory to write the CSV files to
+    :param scale - Multiple of the sam/csv row counts, eg 10 to 1000
+    :param seed - Random seed, the same seed & scale always give the same files
+    :param verbose - Enable verbose mode
+    :return str - Fully qualified import.csv seed file for dbFill, or exception
+    :example - seed = csvSynth('./sam/x10/', 10, 42, False)
+    '''
+    applog = logging.getLogger('AppLog')
+    rnd = random.Random(seed)
+    n = {t: c if t in FIXED else c * scale for t, c in SAMPLE.items()}
+    path = lambda t: os.path.join(outdir, t + '.csv')
+    try:
+        os.makedirs(outdir, exist_ok=True)
+        # Ids below assume a freshly initialised database, ie autoincrement from 1 in file order
+        _csvRows(path('artists'), ['ArtistName'], ([f'Artist {i}'] for i in range(1, n['artists'] + 1)))
+        _csvRows(path('genres'), ['GenreName'], ([f'Genre {i}'] for i in range(1, n['genres'] + 1)))
+        _csvRows(path('mediatypes'), ['MediaTypeName'], ([f'Media Type {i}'] for i in range(1, n['mediatypes'] + 1)))
+        _csvRows(path('playlists'), ['PlayListName'], ([f'Playlist {i}'] for i in range(1, n['playlists'] + 1)))
+        _csvRows(path('albums'), ['Title', 'ArtistId'],
+                 ([f'Album {i}', rnd.randint(1, n['artists'])] for i in range(1, n['albums'] + 1)))
+        _csvRows(path('employees'), ['LastName', 'FirstName', 'Title', 'ReportsTo', 'BirthDate', 'HireDate', 'Address', 'City',
+                                     'State', 'Country', 'PostalCode', 'Phone', 'Fax', 'Email'],
+                 ([f'Last{i}', f'First{i}', 'Sales Support Agent' if i > 1 else 'General Manager', rnd.randint(1, max(i - 1, 1)),
+                   _csvDate(rnd), _csvDate(rnd), f'{i} Jasper Ave', 'Edmonton', 'AB', 'Canada', 'T5K 2N1',
+                   '+1 (780) 428-9482', '+1 (780) 428-3457', f'employee{i}@chinookcorp.com'] for i in range(1, n['employees'] + 1)))
+        _csvRows(path('customers'), ['FirstName', 'LastName', 'Company', 'Address', 'City', 'State', 'Country', 'PostalCode',
+                                     'Phone', 'Fax', 'Email', 'SupportRepId'],
+                 ([f'First{i}', f'Last{i}', '', f'{i} Main Street', f'City {i % 50}', '', rnd.choice(COUNTRIES), f'{i:05d}',
+                   '+1 (555) 555-0100', '', f'customer{i}@example.com', rnd.randint(1, n['employees'])] for i in range(1, n['customers'] + 1)))
+        customers = [rnd.randint(1, n['customers']) for i in range(n['invoices'])]
+        _csvRows(path('invoices'), ['CustomerId', 'InvoiceDate', 'BillingAddress', 'BillingCity', 'BillingState', 'BillingCountry',
+                                    'BillingPostalCode', 'Total'],
+                 ([c, _csvDate(rnd), f'{c} Main Street', f'City {c % 50}', '', rnd.choice(COUNTRIES), f'{c:05d}',
+                   f'{rnd.randint(1, 25) * 0.99:.2f}'] for c in customers))
+        _csvRows(path('tracks'), ['TrackName', 'AlbumId', 'MediaTypeId', 'GenreId', 'Composer', 'Milliseconds', 'Bytes', 'UnitPrice'],
+                 ([f'Track {i}', rnd.randint(1, n['albums']), rnd.randint(1, n['mediatypes']), rnd.randint(1, n['genres']),
+                   rnd.choice(('', f'Composer {i % 500}')), rnd.randint(60000, 600000), rnd.randint(1000000, 20000000),
+                   rnd.choice(('0.99', '1.99'))] for i in range(1, n['tracks'] + 1)))
+        _csvRows(path('invoiceitems'), ['InvoiceId', 'TrackId', 'UnitPrice', 'Quantity'],
+                 ([rnd.randint(1, n['invoices']), rnd.randint(1, n['tracks']), rnd.choice(('0.99', '1.99')), 1]
+                  for i in range(n['invoiceitems'])))
+        _csvRows(path('playlisttracks'), ['PlaylistId', 'TrackId'],
+                 ([rnd.randint(1, n['playlists']), rnd.randint(1, n['tracks'])] for i in range(n['playlisttracks'])))
+        manifest = os.path.join(outdir, 'import.csv')
+        csvWrite(manifest, [t + '.csv' for t in SAMPLE], verbose)
+        applog.info(f'Generated x{scale} sample files in {outdir} from seed {seed}')
+        return manifest
+    except Exception as e:
+        applog.error(e)
+        return e